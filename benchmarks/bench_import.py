@@ -0,0 +1,96 @@
+"""Benchmark for the bulk Excel import in import_data.py.
+
+Writes a synthetic workbook of ROWS products (3 image URLs each) with the
+same headers as the shop export, then times, each in a fresh process so peak
+RSS is measured per run:
+
+  replace      wipe-and-load into an empty database
+  incremental  re-import of the same file (nothing changes)
+  changed      re-import with every 10th price changed
+
+Run from the repo root:
+    python -m benchmarks.bench_import [rows]
+"""
+import asyncio
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from openpyxl import Workbook
+
+from database import init_db
+import import_data
+
+ROWS = 200_000
+
+
+def write_workbook(path: str, rows: int, price_bump: int = 0):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(list(import_data.COLUMN_MAP))
+    for i in range(1, rows + 1):
+        price = 1000.0 + i + (price_bump if i % 10 == 0 else 0)
+        sheet.append([
+            f"ART-{i}",
+            f"Product {i}",
+            f"<p>Description of product {i}</p><br>Second line",
+            price,
+            price * 1.2,
+            i % 7,
+            "Рюкзаки",
+            f"https://www.example.com/product/{i}",
+            "выставлен" if i % 5 else "скрыт",
+            " ".join(f"https://cdn.example.com/{i}/{n}.jpg" for n in range(3)),
+        ])
+    workbook.save(path)
+
+
+def run_import(mode: str, workbook: str, db_name: str, results):
+    async def go():
+        chunks = import_data.read_chunks(workbook)
+        if mode == "replace":
+            return await import_data.replace_all(chunks, db_name)
+        return await import_data.import_incremental(chunks, db_name)
+
+    started = time.perf_counter()
+    rows = asyncio.run(go())
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KB on Linux
+    results.put((rows, elapsed, peak_kb))
+
+
+def measure(mode: str, workbook: str, db_name: str):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_import, args=(mode, workbook, db_name, results))
+    process.start()
+    outcome = results.get()
+    process.join()
+    return outcome
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    with tempfile.TemporaryDirectory() as tmp:
+        workbook = os.path.join(tmp, "catalog.xlsx")
+        changed = os.path.join(tmp, "catalog_changed.xlsx")
+        db_name = os.path.join(tmp, "bench.db")
+
+        print(f"Writing {rows} rows...")
+        write_workbook(workbook, rows)
+        write_workbook(changed, rows, price_bump=1)
+        asyncio.run(init_db(db_name))
+
+        report = []
+        for mode, path in (("replace", workbook), ("incremental", workbook), ("changed", changed)):
+            report.append((mode, *measure("replace" if mode == "replace" else "incremental", path, db_name)))
+
+    print(f"{'mode':>12} {'rows':>10} {'seconds':>10} {'rows/sec':>12} {'peak RSS MB':>12}")
+    for mode, count, elapsed, peak_kb in report:
+        print(f"{mode:>12} {count:>10} {elapsed:>10.2f} {count / elapsed:>12.0f} {peak_kb / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
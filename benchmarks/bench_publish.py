@@ -0,0 +1,301 @@
+"""End-to-end publisher benchmark against a local stand-in Bot API, no network.
+
+For each catalog scale, in a fresh process with its own temporary DB:
+  1. start benchmarks/fake_image_host.py and generate a posted catalog with
+     images on it (benchmarks/catalog.py),
+  2. start benchmarks/fake_bot_api.py and the real watch_products() on an
+     aiogram Bot pointed at it,
+  3. flag UPDATES random products with mark_updater.mark_products() and wait
+     until every one of them is republished.
+
+Reported per scale:
+  products/s     flagged products republished per second
+  e2e p50/p95    seconds from raising needs_update to the product being sent
+  pass ms        mean watch_products pass, DB ms: mean get_products_to_update
+                 and send_product DB reads (from metrics.py)
+  calls, faults  Bot API calls served, 429s and 500s injected, albums refused
+                 for a dead image URL (bad_url); img: image URLs probed
+
+--bad-images makes that share of image URLs dead; --no-image-checks sends them
+to the Bot API unchecked, as before image_checks.py. Products that only failed
+are counted as not done once nothing is left to run.
+
+Telegram's rate limits are lifted unless --paced is given (then keep
+--updates small: a channel takes 20 messages a minute). --channels N routes the
+catalog's categories round-robin over N channels, each with its own bot token. Results are written to
+benchmarks/results/publish-<commit>.json; compare two runs with --compare.
+
+Run from the repo root:
+    python -m benchmarks.bench_publish [--scales 1000 10000 100000] [--updates 1000]
+        [--latency 0.03] [--rate-429 0] [--failure-rate 0] [--paced] [--channels 1]
+        [--bad-images 0] [--no-image-checks]
+    python -m benchmarks.bench_publish --compare old.json new.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+TOKEN = "123456:BENCHMARK"  # channel n > 0 uses 12345<n>:BENCHMARK
+FIELDS = ["products_per_sec", "e2e_p50", "e2e_p95", "pass_ms", "changes_db_ms", "product_db_ms"]
+
+
+def run_scale(size: int, args: dict, results):
+    """Child process: everything imported from the repo sees the temporary DB."""
+    tmp = tempfile.mkdtemp(prefix="bench_publish_")
+    os.environ.update({
+        "DB_NAME": os.path.join(tmp, "bench.db"),
+        "WAKE_SOCKET": os.path.join(tmp, "bench.wake"),
+        "CHANNEL_ID": "-1001000000000",
+        "BOT_TOKEN": TOKEN,
+    })
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(tmp)  # bot.log / errors.log land here
+    try:
+        results.put(asyncio.run(publish_scale(size, args)))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+async def publish_scale(size: int, args: dict) -> dict:
+    import logging
+
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import main
+    import metrics
+    from benchmarks.catalog import CATEGORIES, generate_catalog
+    from benchmarks.fake_bot_api import FakeBotAPI
+    from benchmarks.fake_image_host import FakeImageHost
+    from config import DB_NAME
+    from database import connections, init_db
+    from mark_updater import mark_products
+    from rate_limiter import SendScheduler
+    from reconcile import FINISHED_KEY, set_state
+    from routing import Channel, Router
+
+    logging.getLogger("bot").setLevel(logging.WARNING)
+
+    await init_db(DB_NAME)
+    image_host = FakeImageHost()
+    image_base = await image_host.start()
+    started = time.perf_counter()
+    generate_catalog(DB_NAME, size, image_base=image_base, bad_images=args["bad_images"])
+    seed_seconds = time.perf_counter() - started
+    db = await connections.writer()
+    await set_state(db, FINISHED_KEY, int(time.time()))  # no reconciliation pass during the run
+    await db.commit()
+
+    api = FakeBotAPI(latency=args["latency"], rate_429=args["rate_429"], failure_rate=args["failure_rate"])
+    url = await api.start()
+    channels = [
+        Channel(f"channel{n}", f"-100{n + 1:010d}",
+                Bot(TOKEN if n == 0 else f"12345{n}:BENCHMARK",
+                    session=AiohttpSession(api=TelegramAPIServer.from_base(url))))
+        for n in range(args["channels"])
+    ]
+    router = Router(channels, {category: channels[n % len(channels)].name for n, category in enumerate(CATEGORIES)},
+                    channels[0].name)
+    await main.adopt_unrouted_messages(db, router)  # the catalog's posts, spread like the routes say
+    for category, name in router.routes.items():
+        await db.execute(
+            "UPDATE product_messages SET chat_id = ? "
+            "WHERE product_id IN (SELECT id FROM products WHERE category = ?)",
+            (router.channels[name].chat_id, category)
+        )
+    await db.commit()
+
+    if not args["paced"]:
+        unlimited = 1e9
+        for channel in channels:
+            main.schedulers[channel.bot.id] = SendScheduler(unlimited, unlimited, unlimited, unlimited)
+
+    sent_at = {}
+    mark_product_sent = main.mark_product_sent
+
+    async def stamped(db, product_id, *rest):
+        await mark_product_sent(db, product_id, *rest)
+        sent_at[product_id] = time.perf_counter()
+
+    main.mark_product_sent = stamped
+
+    if args["no_image_checks"]:
+        async def unchecked(db, checker, product_id, image_urls):
+            return image_urls
+
+        async def no_prefetch(db, checker):
+            return 0
+
+        main.usable_images = unchecked
+        main.prefetch_images = no_prefetch
+
+    watcher = asyncio.create_task(main.watch_products(router))
+    await asyncio.sleep(0.5)  # first start: high-water mark and pending flags
+
+    flagged = random.Random(2).sample(range(1, size + 1), min(args["updates"], size))
+    marked_at = time.perf_counter()
+    await asyncio.to_thread(mark_products, ids=flagged, db_name=DB_NAME)
+    deadline = marked_at + args["timeout"]
+    polls = 0
+    while len(sent_at) < len(flagged) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+        polls += 1
+        if polls % 20 == 0 and await settled(db):
+            break  # the rest failed and waits for a retry
+
+    watcher.cancel()
+    try:
+        await watcher
+    except asyncio.CancelledError:
+        pass
+    await router.close()
+    await api.stop()
+    await image_host.stop()
+    await connections.close()
+
+    latencies = sorted(sent_at[pid] - marked_at for pid in flagged if pid in sent_at)
+    finished = max(sent_at.values(), default=marked_at)
+
+    def mean_ms(histogram, **labels):
+        summary = histogram.summary(**labels)
+        return summary[1] * 1000 if summary else 0.0
+
+    return {
+        "scale": size,
+        "updates": len(flagged),
+        "published": len(latencies),
+        "seed_seconds": round(seed_seconds, 2),
+        "products_per_sec": round(len(latencies) / max(finished - marked_at, 1e-9), 1),
+        "e2e_p50": round(statistics.median(latencies), 3) if latencies else None,
+        "e2e_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else None,
+        "pass_ms": round(mean_ms(metrics.PASS_SECONDS), 2),
+        "changes_db_ms": round(mean_ms(metrics.DB_SECONDS, query="get_products_to_update"), 2),
+        "product_db_ms": round(mean_ms(metrics.DB_SECONDS, query="send_product"), 2),
+        "calls": dict(api.calls),
+        "faults": dict(api.faults),
+        "image_checks": sum(image_host.requests.values()),
+    }
+
+
+async def settled(db) -> bool:
+    """Publish jobs are left, none is running and all of them wait for a retry."""
+    rows = await db.execute_fetchall(
+        "SELECT COUNT(*), COUNT(last_error), IFNULL(SUM(state = 'running'), 0) FROM publish_jobs "
+        "WHERE kind = 'publish'"
+    )
+    jobs, failed, running = rows[0]
+    return jobs > 0 and jobs == failed and not running
+
+
+def measure(size: int, args: dict) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_scale, args=(size, args, results))
+    process.start()
+    while True:
+        try:
+            outcome = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"scale {size}: benchmark process died (exit code {process.exitcode})")
+    process.join()
+    return outcome
+
+
+def commit_id() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report: dict):
+    print(f"commit {report['commit']}  latency {report['settings']['latency']}s  "
+          f"429 {report['settings']['rate_429']:.1%}  failures {report['settings']['failure_rate']:.1%}  "
+          f"{'paced' if report['settings']['paced'] else 'unpaced'}  "
+          f"channels {report['settings'].get('channels', 1)}  "
+          f"bad images {report['settings'].get('bad_images', 0):.1%}"
+          f"{' unchecked' if report['settings'].get('no_image_checks') else ''}")
+    print(f"{'scale':>8} {'done':>11} {'products/s':>11} {'e2e p50':>8} {'e2e p95':>8} "
+          f"{'pass ms':>8} {'changes ms':>11} {'product ms':>11}  calls / faults")
+    for row in report["results"]:
+        calls = sum(row["calls"].values())
+        print(f"{row['scale']:>8} {row['published']:>5}/{row['updates']:<5} {row['products_per_sec']:>11.1f} "
+              f"{row['e2e_p50'] or 0:>8.2f} {row['e2e_p95'] or 0:>8.2f} {row['pass_ms']:>8.2f} "
+              f"{row['changes_db_ms']:>11.2f} {row['product_db_ms']:>11.2f}  {calls} / {row['faults'] or '-'}"
+              f" / {row.get('image_checks', 0)} img")
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    old_rows = {row["scale"]: row for row in old["results"]}
+    print(f"{old['commit']} -> {new['commit']}")
+    print(f"{'scale':>8} " + " ".join(f"{field:>22}" for field in FIELDS))
+    for row in new["results"]:
+        before = old_rows.get(row["scale"])
+        if before is None:
+            continue
+        cells = []
+        for field in FIELDS:
+            a, b = before[field] or 0, row[field] or 0
+            change = f"{(b - a) / a:+.0%}" if a else "n/a"
+            cells.append(f"{a:>8.2f} -> {b:<8.2f}{change:>4}")
+        print(f"{row['scale']:>8} " + " ".join(f"{cell:>22}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline publisher benchmark")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--updates", type=int, default=1_000, help="products flagged per scale")
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds per Bot API call")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of calls answered with retry_after")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of calls answered with a 500")
+    parser.add_argument("--paced", action="store_true", help="keep Telegram's rate limits")
+    parser.add_argument("--channels", type=int, default=1, help="channels (and bot tokens) to route over")
+    parser.add_argument("--bad-images", type=float, default=0.0, help="share of image URLs that are dead")
+    parser.add_argument("--no-image-checks", action="store_true", help="send image URLs to the Bot API unchecked")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait per scale")
+    parser.add_argument("--out", help="report path (default benchmarks/results/publish-<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two saved reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    settings = {key: getattr(args, key) for key in ("updates", "latency", "rate_429", "failure_rate", "paced",
+                                                    "channels", "bad_images", "no_image_checks", "timeout")}
+    report = {"commit": commit_id(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "settings": settings,
+              "results": []}
+    for size in args.scales:
+        print(f"Scale {size}...", file=sys.stderr)
+        report["results"].append(measure(size, settings))
+
+    out = args.out or os.path.join(RESULTS_DIR, f"publish-{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print_report(report)
+    print(f"Saved to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Micro-benchmark for one watcher pass of get_products_to_update.
+
+Builds throw-away databases with a growing number of posted products, of which
+a fixed CHANGED are flagged and CHANGED are out of stock, and times the old N+1
+loop against the indexed start-up query and the change-log read from main.py.
+
+Run from the repo root:
+    python -m benchmarks.bench_watch_query
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+import aiosqlite
+
+from database import connect, init_db
+from main import get_pending_products, get_products_to_update
+
+SIZES = [1_000, 10_000, 50_000]
+REPEATS = 5
+CHANGED = 50
+
+
+async def legacy_get_products_to_update(db: aiosqlite.Connection):
+    """The pre-index implementation, kept here only for comparison."""
+    async with db.execute("SELECT DISTINCT product_id FROM product_messages") as cursor:
+        rows = await cursor.fetchall()
+
+    update_list = []
+    delete_list = []
+    for (product_id,) in rows:
+        async with db.execute(
+            "SELECT stock, needs_update FROM products WHERE id = ? AND visible = 1",
+            (product_id,),
+        ) as cur:
+            result = await cur.fetchone()
+        if not result:
+            continue
+        stock, needs_update = result
+        if stock is None or stock == 0:
+            delete_list.append(product_id)
+        elif needs_update == 1:
+            update_list.append(product_id)
+    return update_list, delete_list
+
+
+async def seed(db: aiosqlite.Connection, size: int):
+    await db.executemany(
+        "INSERT INTO products (id, name, visible, stock, needs_update) VALUES (?, ?, 1, ?, ?)",
+        (
+            (i, f"Product {i}", 0 if i <= CHANGED else 5, 1 if CHANGED < i <= 2 * CHANGED else 0)
+            for i in range(1, size + 1)
+        ),
+    )
+    await db.executemany(
+        "INSERT INTO product_images (product_id, image_url) VALUES (?, ?)",
+        ((i, f"https://example.com/{i}/{n}.jpg") for i in range(1, size + 1) for n in range(3)),
+    )
+    await db.executemany(
+        "INSERT INTO product_messages (product_id, message_id) VALUES (?, ?)",
+        ((i, i * 10 + n) for i in range(1, size + 1) for n in range(3)),
+    )
+    # Seeding fired the image triggers; keep only the changes a real pass would see
+    await db.execute("DELETE FROM product_changes")
+    await db.executemany(
+        "INSERT INTO product_changes (product_id, kind) VALUES (?, ?)",
+        ((i, "delete" if i <= CHANGED else "manual") for i in range(1, 2 * CHANGED + 1)),
+    )
+    await db.commit()
+    await db.execute("ANALYZE")
+
+
+async def change_log_pass(db: aiosqlite.Connection):
+    return await get_products_to_update(db, 0)
+
+
+async def timed(func, db) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        await func(db)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+async def main():
+    print(f"{'products':>10} {'legacy ms':>12} {'indexed ms':>12} {'changes ms':>12}")
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            await init_db(path)
+            async with connect(path) as db:
+                await seed(db, size)
+                legacy = await timed(legacy_get_products_to_update, db)
+                indexed = await timed(get_pending_products, db)
+                changes = await timed(change_log_pass, db)
+        print(f"{size:>10} {legacy:>12.2f} {indexed:>12.2f} {changes:>12.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+"""Synthetic catalog for the benchmarks: fills products / product_images.
+
+Every product is visible and in stock, in one of a few categories, with 1-6
+images. With posted=True each one also gets a channel post in
+product_messages, drifted in one of three ways so a republish exercises every
+path of send_product:
+
+  id % 3 == 0  the post has one message fewer than the product has images
+               (delete and repost)
+  id % 3 == 1  the post shows older image URLs (editMessageMedia)
+  id % 3 == 2  the post shows the current images (caption-only edit)
+
+With bad_images > 0 that share of image URLs is dead (missing-*.jpg, a 404
+on benchmarks/fake_image_host.py).
+
+Run from the repo root:
+    python -m benchmarks.catalog bench.db 10000
+"""
+import asyncio
+import random
+import sys
+import time
+
+from database import connect_sync, init_db
+
+CATEGORIES = ["Рюкзаки", "Сумки", "Кошельки", "Чемоданы", "Аксессуары"]
+SCALES = [1_000, 10_000, 100_000]
+BATCH = 10_000
+
+
+def product_row(product_id: int, rng: random.Random):
+    price = float(rng.randrange(500, 50_000, 10))
+    description = "".join(
+        f"<p>Feature {n} of product {product_id}: durable, water-resistant, {rng.randint(1, 40)} l.</p>"
+        for n in range(rng.randint(2, 6))
+    )
+    return (
+        product_id,
+        f"Product {product_id}",
+        f"https://www.example.com/product/{product_id}",
+        description,
+        1,
+        CATEGORIES[product_id % len(CATEGORIES)],
+        f"ART-{product_id}",
+        price,
+        round(price * 1.2, 2),
+        rng.randint(1, 50),
+    )
+
+
+def generate_catalog(db_name: str, size: int, posted: bool = True, seed: int = 1,
+                     image_base: str = "https://cdn.example.com", bad_images: float = 0.0) -> int:
+    """Add `size` products (ids 1..size) to an initialized DB. Returns the image count."""
+    rng = random.Random(seed)
+    bad_rng = random.Random(seed + 1)  # a separate stream: the catalog is the same whatever bad_images is
+    conn = connect_sync(db_name)
+    images = 0
+    message_id = 0
+    try:
+        for start in range(1, size + 1, BATCH):
+            products, product_images, messages = [], [], []
+            for product_id in range(start, min(start + BATCH, size + 1)):
+                products.append(product_row(product_id, rng))
+                urls = [
+                    f"{image_base}/{product_id}/{'missing-' if bad_rng.random() < bad_images else ''}{n}.jpg"
+                    for n in range(rng.randint(1, 6))
+                ]
+                product_images += [(product_id, url) for url in urls]
+                if posted:
+                    drift = product_id % 3
+                    if drift == 0:
+                        shown = urls[:-1] or [f"{image_base}/placeholder.jpg", urls[0]]
+                    elif drift == 1:
+                        shown = [url.replace(".jpg", "-old.jpg") for url in urls]
+                    else:
+                        shown = urls
+                    for url in shown:
+                        message_id += 1
+                        messages.append((product_id, message_id, url))
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO products (id, name, url, description, visible, category, article,
+                                          price, old_price, stock)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    products
+                )
+                conn.executemany("INSERT INTO product_images (product_id, image_url) VALUES (?, ?)", product_images)
+                conn.executemany(
+                    "INSERT INTO product_messages (product_id, message_id, image_url) VALUES (?, ?, ?)", messages
+                )
+                if posted:
+                    # Known to differ from anything send_product computes, so every flag republishes
+                    conn.execute(
+                        "UPDATE products SET caption_hash = 'seed', media_hash = 'seed' WHERE id BETWEEN ? AND ?",
+                        (start, start + BATCH - 1)
+                    )
+            images += len(product_images)
+    finally:
+        conn.close()
+    return images
+
+
+def main():
+    db_name = sys.argv[1]
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else SCALES[0]
+    asyncio.run(init_db(db_name))
+    started = time.perf_counter()
+    images = generate_catalog(db_name, size)
+    print(f"✅ {size} products, {images} images in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Local stand-in for the Telegram Bot API, for load tests without a channel.
+
+Serves /bot<token>/<method> like api.telegram.org for the methods main.py
+uses (sendPhoto, sendMediaGroup, sendMessage, deleteMessage(s), editMessage*)
+and answers with well-formed Message objects. Latency, 429 retry_after
+answers and random server errors are configurable and seeded, so two runs
+with the same settings see the same faults. Photo URLs that
+benchmarks/fake_image_host.py wouldn't serve as an image (missing-*, page-*,
+huge-*) fail the whole call with a 400, like Telegram does.
+
+Point aiogram at it with:
+    Bot(token, session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)))
+
+Standalone (for poking at it with curl):
+    python -m benchmarks.fake_bot_api [port]
+"""
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.03, jitter: float = 0.01, rate_429: float = 0.0,
+                 retry_after: int = 1, failure_rate: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.message_ids = itertools.count(1)
+        self.calls = Counter()
+        self.faults = Counter()
+        self.runner = None
+        self.url = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+        roll = self.random.random()
+        if roll < self.rate_429:
+            self.faults["429"] += 1
+            return self.error(429, f"Too Many Requests: retry after {self.retry_after}",
+                              {"retry_after": self.retry_after})
+        if roll < self.rate_429 + self.failure_rate:
+            self.faults["500"] += 1
+            return self.error(500, "Internal Server Error")
+
+        handler = getattr(self, f"do_{method}", None)
+        if handler is None:
+            return self.error(404, "Not Found: method not found")
+        if self.unfetchable(params):
+            self.faults["bad_url"] += 1
+            return self.error(400, "Bad Request: failed to get HTTP URL content")
+        return web.json_response({"ok": True, "result": handler(params)})
+
+    @staticmethod
+    def unfetchable(params: dict) -> bool:
+        photos = [params.get("photo") or ""]
+        if "media" in params:
+            media = json.loads(params["media"])
+            photos += [item["media"] for item in (media if isinstance(media, list) else [media])]
+        return any(f"/{bad}-" in photo for photo in photos for bad in ("missing", "page", "huge"))
+
+    @staticmethod
+    def error(code: int, description: str, parameters: dict = None) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    def message(self, chat_id, message_id: int = None, photo: str = None, caption: str = None,
+                text: str = None) -> dict:
+        message = {
+            "message_id": message_id or next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else -100, "type": "channel"},
+        }
+        if photo is not None:
+            # A URL gets a fresh file_id; a file_id is echoed back, like Telegram does
+            file_id = photo if photo.startswith("FAKE") else f"FAKE{zlib.crc32(photo.encode())}"
+            message["photo"] = [
+                {"file_id": f"{file_id}s", "file_unique_id": f"{file_id}s", "width": 90, "height": 90},
+                {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 1280},
+            ]
+        if caption is not None:
+            message["caption"] = caption
+        if text is not None:
+            message["text"] = text
+        return message
+
+    def do_sendPhoto(self, params):
+        return self.message(params["chat_id"], photo=params["photo"], caption=params.get("caption"))
+
+    def do_sendMediaGroup(self, params):
+        return [self.message(params["chat_id"], photo=item["media"], caption=item.get("caption"))
+                for item in json.loads(params["media"])]
+
+    def do_sendMessage(self, params):
+        return self.message(params["chat_id"], text=params["text"])
+
+    def do_deleteMessage(self, params):
+        return True
+
+    def do_deleteMessages(self, params):
+        return True
+
+    def do_editMessageText(self, params):
+        return self.message(params["chat_id"], int(params["message_id"]), text=params["text"])
+
+    def do_editMessageCaption(self, params):
+        return self.message(params["chat_id"], int(params["message_id"]), caption=params.get("caption"))
+
+    def do_editMessageMedia(self, params):
+        media = json.loads(params["media"])
+        return self.message(params["chat_id"], int(params["message_id"]), photo=media["media"],
+                            caption=media.get("caption"))
+
+
+async def serve(port: int):
+    api = FakeBotAPI()
+    print(f"Fake Bot API on {await api.start(port=port)}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8081))
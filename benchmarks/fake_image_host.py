@@ -0,0 +1,79 @@
+"""Local stand-in for the shop's image CDN, for image_checks.py without a network.
+
+Serves any path like a CDN serving JPEGs, except:
+
+  .../missing-*   404
+  .../page-*      200 with text/html (a "soft 404" page)
+  .../huge-*      200 image/jpeg of 20 MB (only the headers are ever read)
+
+HEAD and ranged GETs are answered like a real server would; with
+head=False HEAD gets 405, to exercise the GET fallback. benchmarks/catalog.py
+names a share of its image URLs missing-* when asked to.
+
+Standalone (for poking at it with curl):
+    python -m benchmarks.fake_image_host [port]
+"""
+import asyncio
+import sys
+from collections import Counter
+
+from aiohttp import web
+
+IMAGE_BYTES = 48_213
+HUGE_BYTES = 20 * 1024 * 1024
+
+
+class FakeImageHost:
+    def __init__(self, latency: float = 0.02, head: bool = True):
+        self.latency = latency
+        self.head = head
+        self.requests = Counter()
+        self.runner = None
+        self.url = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests[request.method] += 1
+        await asyncio.sleep(self.latency)
+        if request.method == "HEAD" and not self.head:
+            return web.Response(status=405)
+        name = request.path.rsplit("/", 1)[-1]
+        if name.startswith("missing-"):
+            return web.Response(status=404, text="Not Found")
+        if name.startswith("page-"):
+            return web.Response(text="<html>Sorry, this image has moved</html>", content_type="text/html")
+
+        size = HUGE_BYTES if name.startswith("huge-") else IMAGE_BYTES
+        headers = {"Content-Type": "image/jpeg", "Accept-Ranges": "bytes"}
+        if request.method == "GET" and request.headers.get("Range") == "bytes=0-0":
+            headers["Content-Range"] = f"bytes 0-0/{size}"
+            return web.Response(status=206, body=b"\xff", headers=headers)
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(size)
+            return web.Response(headers=headers)
+        return web.Response(body=b"\xff" * min(size, IMAGE_BYTES), headers=headers)
+
+
+async def serve(port: int):
+    host = FakeImageHost()
+    print(f"Fake image host on {await host.start(port=port)}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else 8082))
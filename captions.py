@@ -0,0 +1,255 @@
+# captions.py
+import asyncio
+import hashlib
+import html
+import re
+import sys
+from html.parser import HTMLParser
+
+import aiosqlite
+
+from database import connect, iter_products
+
+CAPTION_LIMIT = 1024   # Telegram's caption limit, counted in UTF-16 units of the visible text
+RENDER_VERSION = 1     # part of every cache key: bump it when render_caption's output changes
+ELLIPSIS = "…"
+
+# Telegram's HTML subset. Shop markup is mapped onto it; any other tag is
+# dropped and only its text kept.
+INLINE_TAGS = {
+    "b": "b", "strong": "b", "i": "i", "em": "i", "u": "u", "ins": "u",
+    "s": "s", "strike": "s", "del": "s", "tg-spoiler": "tg-spoiler",
+    "code": "code", "pre": "pre", "blockquote": "blockquote",
+    "h1": "b", "h2": "b", "h3": "b", "h4": "b", "h5": "b", "h6": "b",
+}
+BLOCK_TAGS = {"p", "div", "ul", "ol", "table", "tr", "pre", "blockquote", "h1", "h2", "h3", "h4", "h5", "h6"}
+SKIPPED_TAGS = {"script", "style", "head", "title"}
+LINK_SCHEMES = ("http://", "https://", "tg://", "mailto:")
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def cut_utf16(text: str, units: int) -> str:
+    """Longest prefix of text no longer than `units`, never splitting a character."""
+    if utf16_len(text) <= units:
+        return text
+    prefix = text.encode("utf-16-le")[:max(units, 0) * 2].decode("utf-16-le", errors="ignore")
+    # Prefer a word boundary unless that throws away most of the piece
+    head, space, _ = prefix.rpartition(" ")
+    return head.rstrip() if space and len(head) >= len(prefix) // 2 else prefix
+
+
+class TelegramHTML(HTMLParser):
+    """Converts shop HTML to Telegram's subset in one pass over the markup.
+
+    Text is unescaped by the parser and escaped again on output, so `&`, `<`
+    and `>` always reach Telegram as entities. Output stops once `budget`
+    visible units are used: the text is cut on a word boundary, an ellipsis
+    added and every open tag closed, so the result is always valid markup.
+    """
+
+    def __init__(self, budget: int):
+        super().__init__(convert_charrefs=True)
+        self.budget = budget
+        self.used = 0
+        self.out = []
+        self.open = []          # Telegram tags currently open, outermost first
+        self.breaks = 0         # newlines owed before the next text
+        self.space = False      # a space owed before the next text (dropped before a break)
+        self.skipping = 0       # depth inside <script>/<style>
+        self.truncated = False
+
+    def render(self, markup: str) -> str:
+        self.feed(markup)
+        self.close()
+        for tag in reversed(self.open):
+            self.out.append(f"</{tag}>")
+        return "".join(self.out)
+
+    def request_break(self, count: int):
+        if self.used:  # never at the very start
+            self.breaks = max(self.breaks, count)
+
+    def flush_space(self):
+        """Emit an owed space now, so it lands outside the tag about to open."""
+        if self.space and self.used and not self.breaks and self.used < self.budget:
+            self.out.append(" ")
+            self.used += 1
+        self.space = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.truncated:
+            return
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag == "br":
+            self.breaks = min(self.breaks + 1, 2) if self.used else 0
+        elif tag == "li":
+            self.request_break(1)
+            self.handle_data("• ")
+        elif tag in BLOCK_TAGS:
+            self.request_break(2)
+        if self.skipping or "pre" in self.open or "code" in self.open:
+            return  # Telegram allows no markup inside these
+
+        if tag == "a":
+            href = dict(attrs).get("href") or ""
+            if href.startswith(LINK_SCHEMES) and "a" not in self.open:
+                self.flush_space()
+                self.out.append(f'<a href="{html.escape(href)}">')
+                self.open.append("a")
+        elif tag in INLINE_TAGS and INLINE_TAGS[tag] not in self.open:
+            self.flush_space()
+            self.out.append(f"<{INLINE_TAGS[tag]}>")
+            self.open.append(INLINE_TAGS[tag])
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+            return
+        if self.truncated:
+            return
+        target = "a" if tag == "a" else INLINE_TAGS.get(tag)
+        if target in self.open:
+            # Close down to the tag and reopen what was nested in it, so the output nests properly
+            index = self.open.index(target)
+            inner = self.open[index + 1:]
+            for name in reversed(self.open[index:]):
+                self.out.append(f"</{name}>")
+            del self.open[index:]
+            for name in inner:
+                self.out.append(f"<{name}>")
+                self.open.append(name)
+        if tag in BLOCK_TAGS or tag == "li":
+            self.request_break(2 if tag in BLOCK_TAGS else 1)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_data(self, data):
+        if self.truncated or self.skipping:
+            return
+        if "pre" in self.open:
+            separator = "\n" * self.breaks
+        else:
+            data = WHITESPACE.sub(" ", data)
+            self.space |= data.startswith(" ")
+            separator = "\n" * self.breaks or (" " if self.space and self.used else "")
+            self.space = data.endswith(" ")
+            data = data.strip()
+        if not data:
+            return
+
+        text = separator + data
+        length = utf16_len(text)
+        if self.used + length > self.budget:
+            room = self.budget - self.used - utf16_len(ELLIPSIS) - len(separator)
+            if room > 0:
+                text = (separator + cut_utf16(data, room)).rstrip() + ELLIPSIS
+            elif self.used and self.budget - self.used >= utf16_len(ELLIPSIS):
+                text = ELLIPSIS
+            else:
+                text = ""
+            self.truncated = True
+            length = utf16_len(text)
+        self.out.append(html.escape(text, quote=False))
+        self.used += length
+        self.breaks = 0
+
+
+def render_description(description: str, budget: int) -> str:
+    """Telegram HTML for a product description, at most `budget` visible units long."""
+    if not description or budget <= 0:
+        return ""
+    return TelegramHTML(budget).render(description).strip()
+
+
+def render_caption(name: str, description: str, url: str) -> str:
+    """The post caption: bold name, description, link; never over CAPTION_LIMIT."""
+    name = WHITESPACE.sub(" ", name or "").strip()
+    url = url or ""
+    footer = f"🔗 More info: {url}"
+    # Visible length of everything but the description (tags don't count)
+    budget = CAPTION_LIMIT - utf16_len(f"🛒 {name}\n\n") - utf16_len(f"\n\n{footer}")
+    if budget < 0:
+        name = cut_utf16(name, utf16_len(name) + budget - utf16_len(ELLIPSIS)) + ELLIPSIS
+    body = render_description(description, budget)
+    parts = [f"🛒 <b>{html.escape(name, quote=False)}</b>", body, html.escape(footer, quote=False)]
+    return "\n\n".join(part for part in parts if part)
+
+
+def caption_key(name: str, description: str, url: str) -> str:
+    """Cache key: hash of the description and the fields rendered around it.
+
+    The name and URL are part of it because they share the caption limit with
+    the description and so decide where it is cut.
+    """
+    source = "\x00".join((str(RENDER_VERSION), name or "", description or "", url or ""))
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+
+async def get_caption(db: aiosqlite.Connection, name: str, description: str, url: str) -> str:
+    """Rendered caption from rendered_captions; rendered and stored on a miss.
+
+    The new row is committed right away: the caller goes on to Telegram, and
+    an open write transaction would hold the database lock across those calls.
+    """
+    key = caption_key(name, description, url)
+    async with db.execute("SELECT caption FROM rendered_captions WHERE source_hash = ?", (key,)) as cursor:
+        row = await cursor.fetchone()
+    if row:
+        return row[0]
+    caption = render_caption(name, description, url)
+    await db.execute(
+        "INSERT OR REPLACE INTO rendered_captions (source_hash, caption) VALUES (?, ?)", (key, caption)
+    )
+    await db.commit()
+    return caption
+
+
+async def refresh_captions(db: aiosqlite.Connection):
+    """Pre-render the captions of all visible products that aren't cached yet
+    and drop cached ones no product renders to any more. Run by the importer
+    in its transaction, so publishing a freshly imported product is a lookup.
+    Returns (rendered, pruned).
+    """
+    async with db.execute("SELECT source_hash FROM rendered_captions") as cursor:
+        cached = {key for (key,) in await cursor.fetchall()}
+
+    wanted = set()
+    rendered = []
+    async for product in iter_products(db, ("name", "description", "url"), where="visible = 1"):
+        key = caption_key(product.name, product.description, product.url)
+        if key not in wanted and key not in cached:
+            rendered.append((key, render_caption(product.name, product.description, product.url)))
+        wanted.add(key)
+
+    stale = [(key,) for key in cached - wanted]
+    await db.executemany("INSERT OR REPLACE INTO rendered_captions (source_hash, caption) VALUES (?, ?)", rendered)
+    await db.executemany("DELETE FROM rendered_captions WHERE source_hash = ?", stale)
+    return len(rendered), len(stale)
+
+
+async def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    async with connect() as db:
+        if command == "refresh":
+            rendered, pruned = await refresh_captions(db)
+            await db.commit()
+            print(f"✅ Rendered {rendered} captions, pruned {pruned}.")
+        elif command == "show" and len(sys.argv) > 2:
+            async with db.execute(
+                "SELECT name, description, url FROM products WHERE id = ?", (int(sys.argv[2]),)
+            ) as cursor:
+                row = await cursor.fetchone()
+            print(render_caption(*row) if row else "No such product.")
+        else:
+            print("Usage: python captions.py [refresh | show <product_id>]")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -6,4 +6,9 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHANNEL_ID = os.getenv("CHANNEL_ID")
 DB_NAME = os.getenv("DB_NAME", "products.db")  # fallback just in case
-EXCEL_FILE = os.getenv("EXCEL_FILE")
\ No newline at end of file
+EXCEL_FILE = os.getenv("EXCEL_FILE")
+WAKE_SOCKET = os.getenv("WAKE_SOCKET", f"{DB_NAME}.wake")  # watchers listen on <this>.<pid>, see notify.py
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # Prometheus endpoint, 0 turns it off; see metrics.py
+METRICS_DUMP_INTERVAL = int(os.getenv("METRICS_DUMP_INTERVAL", "0"))  # seconds between summaries in bot.log, 0 = off
+ROUTES_FILE = os.getenv("ROUTES_FILE", "channels.json")  # category -> channel routing, see routing.py
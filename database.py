@@ -2,6 +2,10 @@
 import aiosqlite
 import asyncio
 import datetime
+import json
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import NamedTuple
 
 from config import DB_NAME
 
@@ -17,7 +21,10 @@ CREATE TABLE IF NOT EXISTS products (
     price REAL,           -- Цена продажи
     old_price REAL,       -- Старая цена
     stock INTEGER,        -- Остаток
-    message_id INTEGER    -- message_id in Telegram channel (optional)
+    message_id INTEGER,   -- message_id in Telegram channel (optional)
+    needs_update INTEGER DEFAULT 0,  -- 1 => repost on next watcher pass
+    caption_hash TEXT,    -- fingerprint of the caption as last posted
+    media_hash TEXT       -- fingerprint of the image URL list as last posted
 );
 """
 
@@ -30,12 +37,393 @@ CREATE TABLE IF NOT EXISTS product_images (
 );
 """
 
+CREATE_TABLE_MESSAGES = """
+CREATE TABLE IF NOT EXISTS product_messages (
+    product_id INTEGER,
+    message_id INTEGER,
+    image_url TEXT,       -- photo shown in this message, NULL for text posts
+    chat_id TEXT          -- channel the message is in, see routing.py
+);
+"""
+
+# Outbox of product changes, appended by the triggers below and consumed by the
+# watcher from the high-water mark stored in watcher_state.
+CREATE_TABLE_CHANGES = """
+CREATE TABLE IF NOT EXISTS product_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,   -- new / price / stock / name / description / category / visible / images / manual / delete
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+CREATE_TABLE_STATE = """
+CREATE TABLE IF NOT EXISTS watcher_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+# Durable work for the publisher, see job_queue.py. One row per product:
+# re-enqueueing bumps `generation` so a worker that finishes an older version
+# of the job knows to run it again. Times are unix timestamps.
+CREATE_TABLE_JOBS = """
+CREATE TABLE IF NOT EXISTS publish_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL UNIQUE,
+    kind TEXT NOT NULL,                 -- publish (post or edit in place) / delete
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending / running
+    priority INTEGER NOT NULL DEFAULT 2,    -- 0 removal, 1 price, 2 content, 3 cosmetic, minus aging; see job_queue.py
+    enqueued_at REAL,                   -- when the job was first queued
+    aged_at REAL,                       -- when priority was set or last raised by job_queue.age_jobs
+    channel TEXT,                       -- channel a publish job goes to, NULL until job_queue.route_jobs
+    attempts INTEGER NOT NULL DEFAULT 0,
+    generation INTEGER NOT NULL DEFAULT 0,
+    next_run_at REAL NOT NULL,
+    lease_until REAL,                   -- running jobs past this are reclaimed
+    lease_owner TEXT,                   -- watcher run holding the lease, see watchers
+    last_error TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Jobs that ran out of attempts; inspect and replay with `python job_queue.py`
+CREATE_TABLE_DEAD_JOBS = """
+CREATE TABLE IF NOT EXISTS dead_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Watcher runs alive on this DB file (several processes may share it). Each one
+# renews its heartbeat and its job leases every few seconds; see job_queue.py.
+CREATE_TABLE_WATCHERS = """
+CREATE TABLE IF NOT EXISTS watchers (
+    owner TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+# file_ids Telegram returned for uploaded product photos. A file_id is only
+# valid for the bot that received it, hence the bot_id in the key.
+CREATE_TABLE_FILE_IDS = """
+CREATE TABLE IF NOT EXISTS telegram_files (
+    image_url TEXT NOT NULL,
+    bot_id INTEGER NOT NULL,
+    file_id TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (image_url, bot_id)
+);
+"""
+
+# Post captions rendered from the shop's HTML, see captions.py. Filled by the
+# importer and on a miss by the watcher, so publishing is a primary-key lookup.
+CREATE_TABLE_CAPTIONS = """
+CREATE TABLE IF NOT EXISTS rendered_captions (
+    source_hash TEXT PRIMARY KEY,       -- captions.caption_key of name, description and url
+    caption TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Last probe of every image URL, see image_checks.py. Bad images are left out
+# of posts instead of failing the whole album; rows are re-checked after a TTL.
+CREATE_TABLE_IMAGE_CHECKS = """
+CREATE TABLE IF NOT EXISTS image_checks (
+    image_url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,            -- HTTP status, 0 = unreachable
+    content_type TEXT,
+    size INTEGER,                       -- bytes, NULL if the server didn't say
+    ok INTEGER NOT NULL,                -- usable as a Telegram photo
+    checked_at REAL NOT NULL
+);
+"""
+
+# Run by the importer in its transaction: forget file_ids of URLs no product uses any more
+PRUNE_FILE_IDS_SQL = """
+DELETE FROM telegram_files
+WHERE NOT EXISTS (SELECT 1 FROM product_images i WHERE i.image_url = telegram_files.image_url)
+"""
+
+PRUNE_IMAGE_CHECKS_SQL = """
+DELETE FROM image_checks
+WHERE NOT EXISTS (SELECT 1 FROM product_images i WHERE i.image_url = image_checks.image_url)
+"""
+
+CREATE_TRIGGERS = [
+    # A new product is posted by the next watcher pass, images or not
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_insert AFTER INSERT ON products
+    BEGIN
+        INSERT INTO product_changes (product_id, kind) VALUES (NEW.id, 'new');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_price AFTER UPDATE OF price, old_price ON products
+    WHEN OLD.price IS NOT NEW.price OR OLD.old_price IS NOT NEW.old_price
+    BEGIN
+        INSERT INTO product_changes (product_id, kind) VALUES (NEW.id, 'price');
+    END
+    """,
+    # Running out of stock is a removal, any other stock movement is informational
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_stock AFTER UPDATE OF stock ON products
+    WHEN OLD.stock IS NOT NEW.stock
+    BEGIN
+        INSERT INTO product_changes (product_id, kind)
+        VALUES (NEW.id, CASE WHEN IFNULL(NEW.stock, 0) = 0 THEN 'delete' ELSE 'stock' END);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_name AFTER UPDATE OF name ON products
+    WHEN OLD.name IS NOT NEW.name
+    BEGIN
+        INSERT INTO product_changes (product_id, kind) VALUES (NEW.id, 'name');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_description AFTER UPDATE OF description ON products
+    WHEN OLD.description IS NOT NEW.description
+    BEGIN
+        INSERT INTO product_changes (product_id, kind) VALUES (NEW.id, 'description');
+    END
+    """,
+    # A new category can mean a new channel (see routing.py)
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_category AFTER UPDATE OF category ON products
+    WHEN OLD.category IS NOT NEW.category
+    BEGIN
+        INSERT INTO product_changes (product_id, kind) VALUES (NEW.id, 'category');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_visible AFTER UPDATE OF visible ON products
+    WHEN OLD.visible IS NOT NEW.visible
+    BEGIN
+        INSERT INTO product_changes (product_id, kind)
+        VALUES (NEW.id, CASE WHEN NEW.visible = 1 THEN 'visible' ELSE 'delete' END);
+    END
+    """,
+    # mark_updater.py still works: raising the flag is logged like any other change
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_products_needs_update AFTER UPDATE OF needs_update ON products
+    WHEN NEW.needs_update = 1 AND OLD.needs_update IS NOT 1
+    BEGIN
+        INSERT INTO product_changes (product_id, kind) VALUES (NEW.id, 'manual');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_product_images_insert AFTER INSERT ON product_images
+    BEGIN
+        INSERT INTO product_changes (product_id, kind) VALUES (NEW.product_id, 'images');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_product_images_delete AFTER DELETE ON product_images
+    BEGIN
+        INSERT INTO product_changes (product_id, kind) VALUES (OLD.product_id, 'images');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_product_images_update AFTER UPDATE ON product_images
+    BEGIN
+        INSERT INTO product_changes (product_id, kind) VALUES (NEW.product_id, 'images');
+    END
+    """,
+]
+
+# The watcher queries these on every pass (up to once per MIN_POLL_INTERVAL, see
+# main.py), so every lookup it does must be an index probe. The partial indexes
+# only hold the handful of rows the watcher cares about (flagged / out of stock),
+# not the whole catalog.
+CREATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_product_messages_product_id ON product_messages(product_id)",
+    "CREATE INDEX IF NOT EXISTS idx_product_images_product_id ON product_images(product_id)",
+    "CREATE INDEX IF NOT EXISTS idx_product_images_image_url ON product_images(image_url)",
+    "CREATE INDEX IF NOT EXISTS idx_products_needs_update ON products(id) WHERE needs_update = 1",
+    "CREATE INDEX IF NOT EXISTS idx_products_out_of_stock ON products(id) WHERE IFNULL(stock, 0) = 0",
+    "CREATE INDEX IF NOT EXISTS idx_publish_jobs_due ON publish_jobs(state, next_run_at)",
+    # claim_jobs walks this in order and stops after a few rows; route_jobs and
+    # age_jobs only visit the jobs they still have to change
+    "CREATE INDEX IF NOT EXISTS idx_publish_jobs_claim ON publish_jobs(kind, state, channel, priority, next_run_at)",
+    "CREATE INDEX IF NOT EXISTS idx_publish_jobs_unrouted ON publish_jobs(id) WHERE kind = 'publish' AND channel IS NULL",
+    "CREATE INDEX IF NOT EXISTS idx_publish_jobs_aging ON publish_jobs(aged_at) WHERE priority > 0",
+]
+
+
+# Applied to every connection opened on the DB file, by the bot, the importer
+# and mark_updater alike. WAL lets readers run while one writer commits.
+BUSY_TIMEOUT_MS = 5000
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+]
+STATEMENT_CACHE_SIZE = 256  # prepared statements kept per connection
+READER_POOL_SIZE = 2
+
+
+async def open_connection(db_name: str = DB_NAME, read_only: bool = False) -> aiosqlite.Connection:
+    """Open an aiosqlite connection with the shared pragmas applied."""
+    db = await aiosqlite.connect(db_name, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in CONNECTION_PRAGMAS:
+        await db.execute(pragma)
+    if read_only:
+        await db.execute("PRAGMA query_only = ON")
+    return db
+
+
+@asynccontextmanager
+async def connect(db_name: str = DB_NAME, read_only: bool = False):
+    """Drop-in replacement for `async with aiosqlite.connect(...)` for one-off scripts."""
+    db = await open_connection(db_name, read_only)
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+async def begin_immediate(db: aiosqlite.Connection):
+    """Take the write lock now instead of at the first write.
+
+    For read-then-write steps (change log, reconciliation cursor): a second
+    watcher process waits here and then reads what the first one wrote.
+    """
+    if db.in_transaction:
+        await db.commit()
+    await db.execute("BEGIN IMMEDIATE")
+
+
+def connect_sync(db_name: str = DB_NAME) -> sqlite3.Connection:
+    """Blocking connection with the same pragmas, for command-line tools."""
+    conn = sqlite3.connect(db_name, cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionManager:
+    """One shared writer connection plus a small pool of read-only connections.
+
+    Connections are opened lazily and live until close(), so the helpers below
+    and the watcher don't pay a connect per call.
+    """
+
+    def __init__(self, db_name: str = DB_NAME, readers: int = READER_POOL_SIZE):
+        self.db_name = db_name
+        self.reader_count = readers
+        self._writer = None
+        self._readers = None
+        self._lock = asyncio.Lock()
+
+    async def writer(self) -> aiosqlite.Connection:
+        async with self._lock:
+            if self._writer is None:
+                self._writer = await open_connection(self.db_name)
+        return self._writer
+
+    @asynccontextmanager
+    async def reader(self):
+        async with self._lock:
+            if self._readers is None:
+                self._readers = asyncio.Queue()
+                for _ in range(self.reader_count):
+                    self._readers.put_nowait(await open_connection(self.db_name, read_only=True))
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    async def close(self):
+        async with self._lock:
+            if self._writer is not None:
+                await self._writer.close()
+                self._writer = None
+            if self._readers is not None:
+                while not self._readers.empty():
+                    await self._readers.get_nowait().close()
+                self._readers = None
+
 
-async def init_db():
-    """Create the DB file and products table if they don't exist."""
-    async with aiosqlite.connect(DB_NAME) as db:
+connections = ConnectionManager()
+
+
+# Posts made before product_messages.image_url existed: the n-th message of a
+# post showed the n-th non-empty image of the product, in id order. Only posts
+# whose product still has as many images and no pending update are filled in;
+# the rest keep NULL and have their photos replaced on the next edit.
+BACKFILL_MESSAGE_IMAGES_SQL = """
+    WITH messages AS (
+        SELECT rowid AS message_rowid, product_id,
+               ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY message_id) AS position,
+               COUNT(*) OVER (PARTITION BY product_id) AS total
+        FROM product_messages
+    ), images AS (
+        SELECT product_id, image_url,
+               ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY id) AS position,
+               COUNT(*) OVER (PARTITION BY product_id) AS total
+        FROM product_images
+        WHERE image_url <> ''
+    )
+    UPDATE product_messages
+    SET image_url = (
+        SELECT i.image_url
+        FROM messages m
+        JOIN images i ON i.product_id = m.product_id AND i.position = m.position AND i.total = m.total
+        WHERE m.message_rowid = product_messages.rowid
+    )
+    WHERE image_url IS NULL
+      AND product_id IN (SELECT id FROM products WHERE IFNULL(needs_update, 0) = 0)
+"""
+
+
+async def ensure_column(db: aiosqlite.Connection, table: str, column: str, definition: str) -> bool:
+    """Add a column to an existing table created by an older version of the schema.
+    Returns True if it had to be added."""
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+
+async def init_db(db_name: str = DB_NAME):
+    """Create the DB file, tables and indexes if they don't exist."""
+    async with connect(db_name) as db:
         await db.execute(CREATE_TABLE_IMAGES)
         await db.execute(CREATE_TABLE_PRODUCTS)
+        await db.execute(CREATE_TABLE_MESSAGES)
+        await db.execute(CREATE_TABLE_CHANGES)
+        await db.execute(CREATE_TABLE_STATE)
+        await db.execute(CREATE_TABLE_FILE_IDS)
+        await db.execute(CREATE_TABLE_JOBS)
+        await db.execute(CREATE_TABLE_DEAD_JOBS)
+        await db.execute(CREATE_TABLE_WATCHERS)
+        await db.execute(CREATE_TABLE_CAPTIONS)
+        await db.execute(CREATE_TABLE_IMAGE_CHECKS)
+        await ensure_column(db, "products", "needs_update", "INTEGER DEFAULT 0")
+        await ensure_column(db, "products", "caption_hash", "TEXT")
+        await ensure_column(db, "products", "media_hash", "TEXT")
+        if await ensure_column(db, "product_messages", "image_url", "TEXT"):
+            # Without this every legacy post would have all its photos re-uploaded on its first edit
+            await db.execute(BACKFILL_MESSAGE_IMAGES_SQL)
+        await ensure_column(db, "product_messages", "chat_id", "TEXT")
+        await ensure_column(db, "publish_jobs", "priority", "INTEGER NOT NULL DEFAULT 2")
+        await ensure_column(db, "publish_jobs", "enqueued_at", "REAL")
+        if await ensure_column(db, "publish_jobs", "aged_at", "REAL"):
+            await db.execute("UPDATE publish_jobs SET aged_at = IFNULL(enqueued_at, next_run_at)")
+        await ensure_column(db, "publish_jobs", "channel", "TEXT")
+        await ensure_column(db, "publish_jobs", "lease_owner", "TEXT")
+        for statement in CREATE_INDEXES + CREATE_TRIGGERS:
+            await db.execute(statement)
         await db.commit()
 
 
@@ -43,49 +431,135 @@ async def add_product(product: dict):
     """Insert a new product record.
     product keys: name, url, description, visible (0/1), category, article, price, old_price, stock, message_id(optional)
     """
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute(
-            """
-            INSERT INTO products
-            (name, url, description, visible, category, article, price, old_price, stock, message_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                product.get("name"),
-                product.get("url"),
-                product.get("description"),
-                1 if product.get("visible") else 0,
-                product.get("category"),
-                product.get("article"),
-                product.get("price"),
-                product.get("old_price"),
-                product.get("stock"),
-                product.get("message_id"),
-            ),
-        )
-        await db.commit()
+    db = await connections.writer()
+    await db.execute(
+        """
+        INSERT INTO products
+        (name, url, description, visible, category, article, price, old_price, stock, message_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            product.get("name"),
+            product.get("url"),
+            product.get("description"),
+            1 if product.get("visible") else 0,
+            product.get("category"),
+            product.get("article"),
+            product.get("price"),
+            product.get("old_price"),
+            product.get("stock"),
+            product.get("message_id"),
+        ),
+    )
+    await db.commit()
+
+
+class Product(NamedTuple):
+    """A products row as read by iter_products. Fields follow the table, so it
+    still indexes like a `SELECT *` tuple; columns left out of the projection
+    are None, and so is `images` unless it was asked for."""
+    id: int
+    name: str = None
+    url: str = None
+    description: str = None
+    visible: int = None
+    category: str = None
+    article: str = None
+    price: float = None
+    old_price: float = None
+    stock: int = None
+    message_id: int = None
+    needs_update: int = None
+    caption_hash: str = None
+    media_hash: str = None
+    images: tuple[str, ...] = None
+
+
+PRODUCT_FIELDS = Product._fields[:-1]
+SCAN_BATCH_SIZE = 1000  # products read per query by iter_products
+
+
+async def iter_product_batches(db: aiosqlite.Connection = None, columns=PRODUCT_FIELDS, where: str = None,
+                               params: dict = None, images: bool = False, after: int = 0,
+                               batch_size: int = SCAN_BATCH_SIZE):
+    """Yield lists of Product records in id order, batch_size at a time.
+
+    Keyset pagination (id > last id seen), so every batch is an index range
+    scan and memory stays at one batch whatever the catalog size. Only
+    `columns` are read; `where` is an SQL condition on products with named
+    `params`. With images=True each record carries its image URLs, read for
+    the whole batch in one query. Without `db`, each batch borrows a pooled
+    reader, so a slow consumer doesn't hold a connection between batches.
+    """
+    unknown = set(columns) - set(PRODUCT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown product columns: {', '.join(sorted(unknown))}")
+    selected = ", ".join(field if field == "id" or field in columns else "NULL" for field in PRODUCT_FIELDS)
+    query = (
+        f"SELECT {selected} FROM products WHERE id > :after"
+        f"{f' AND ({where})' if where else ''} ORDER BY id LIMIT :limit"
+    )
+
+    while True:
+        bound = {**(params or {}), "after": after, "limit": batch_size}
+        if db is None:
+            async with connections.reader() as reader:
+                rows, image_map = await _read_product_batch(reader, query, bound, images)
+        else:
+            rows, image_map = await _read_product_batch(db, query, bound, images)
+        if not rows:
+            return
+        if images:
+            yield [Product(*row, tuple(image_map.get(row[0], ()))) for row in rows]
+        else:
+            yield [Product(*row) for row in rows]
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][0]
+
+
+async def _read_product_batch(db: aiosqlite.Connection, query: str, params: dict, images: bool):
+    rows = await db.execute_fetchall(query, params)
+    image_map = {}
+    if images and rows:
+        # One query for the whole batch, probing the product_id index per selected
+        # product: a `where` filter can leave wide gaps between the ids of a batch
+        for product_id, image_url in await db.execute_fetchall(
+            "SELECT product_id, image_url FROM product_images "
+            "WHERE product_id IN (SELECT value FROM json_each(?)) ORDER BY id",
+            (json.dumps([row[0] for row in rows]),)
+        ):
+            image_map.setdefault(product_id, []).append(image_url)
+    return rows, image_map
+
+
+async def iter_products(db: aiosqlite.Connection = None, columns=PRODUCT_FIELDS, where: str = None,
+                        params: dict = None, images: bool = False, after: int = 0,
+                        batch_size: int = SCAN_BATCH_SIZE):
+    """Stream Product records one by one; see iter_product_batches."""
+    async for batch in iter_product_batches(db, columns, where, params, images, after, batch_size):
+        for product in batch:
+            yield product
 
 
 async def get_all_products():
-    """Return a list of rows (tuples) for all products."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT * FROM products") as cursor:
-            rows = await cursor.fetchall()
-            return rows
+    """Return all products as a list of Product records. Loads the whole
+    catalog; scans should use iter_products instead."""
+    return [product async for product in iter_products()]
 
 
 async def update_stock(product_id: int, new_stock: int):
     """Update stock for a product by id."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("UPDATE products SET stock = ? WHERE id = ?", (new_stock, product_id))
-        await db.commit()
+    db = await connections.writer()
+    await db.execute("UPDATE products SET stock = ? WHERE id = ?", (new_stock, product_id))
+    await db.commit()
 
 
 async def delete_product(product_id: int):
     """Delete product by id."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM products WHERE id = ?", (product_id,))
-        await db.commit()
+    db = await connections.writer()
+    await db.execute("DELETE FROM products WHERE id = ?", (product_id,))
+    await db.commit()
 
 if __name__ == "__main__":
     asyncio.run(init_db())
\ No newline at end of file
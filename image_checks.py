@@ -0,0 +1,210 @@
+# image_checks.py
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import NamedTuple
+
+import aiohttp
+import aiosqlite
+
+from database import connect
+from metrics import IMAGE_CHECKS, IMAGE_CHECK_SECONDS, IMAGES_EXCLUDED
+
+CHECK_CONCURRENCY = 8          # image requests in flight at once, across all hosts
+CHECK_TIMEOUT = 10             # seconds per image request
+GOOD_TTL = 24 * 60 * 60        # a good image is checked again after this many seconds
+BAD_TTL = 60 * 60              # a bad one sooner: CDN hiccups heal
+PREFETCH_BATCH = 200           # image URLs of pending jobs checked per watcher pass
+MAX_PHOTO_BYTES = 5 * 1024 * 1024  # Telegram refuses photos sent by URL above this
+PHOTO_TYPES = {"image/jpeg", "image/jpg", "image/png", "image/webp", "image/gif"}
+
+error_logger = logging.getLogger("errors")
+
+
+class ImageCheck(NamedTuple):
+    url: str
+    status: int              # HTTP status, 0 when the request itself failed
+    content_type: str
+    size: int                # bytes, None when the server didn't say
+    checked_at: float
+
+    @property
+    def ok(self) -> bool:
+        """Would Telegram accept this URL as a photo?"""
+        return (
+            200 <= self.status < 300
+            and self.content_type in PHOTO_TYPES
+            and (self.size is None or self.size <= MAX_PHOTO_BYTES)
+        )
+
+    def describe(self) -> str:
+        if self.status == 0:
+            return "unreachable"
+        if not 200 <= self.status < 300:
+            return f"HTTP {self.status}"
+        if self.content_type not in PHOTO_TYPES:
+            return f"not a photo ({self.content_type or 'no content type'})"
+        return f"too large ({self.size} bytes)"
+
+
+class ImageChecker:
+    """Pooled HTTP client that probes image URLs like Telegram will fetch them.
+
+    One aiohttp session (opened on first use) with at most CHECK_CONCURRENCY
+    requests in flight. A probe is a HEAD request; servers that don't answer
+    HEAD properly get a one-byte ranged GET instead, so no image is downloaded.
+    """
+
+    def __init__(self, concurrency: int = CHECK_CONCURRENCY, timeout: float = CHECK_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._session = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def probe(self, url: str) -> ImageCheck:
+        async with self._semaphore:
+            started = time.perf_counter()
+            session = await self.session()
+            try:
+                async with session.head(url, allow_redirects=True) as response:
+                    status, headers = response.status, response.headers
+                if status in (403, 405, 501) or (200 <= status < 300 and "Content-Type" not in headers):
+                    async with session.get(url, headers={"Range": "bytes=0-0"}) as response:
+                        status, headers = response.status, response.headers
+                check = ImageCheck(url, status, _content_type(headers), _size(headers), time.time())
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                check = ImageCheck(url, 0, None, None, time.time())
+            IMAGE_CHECK_SECONDS.observe(time.perf_counter() - started)
+        IMAGE_CHECKS.inc(result="ok" if check.ok else "bad")
+        return check
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def _content_type(headers) -> str:
+    value = headers.get("Content-Type")
+    return value.split(";")[0].strip().lower() if value else None
+
+
+def _size(headers) -> int:
+    # A ranged answer has the full size after the slash: "bytes 0-0/12345"
+    total = headers.get("Content-Range", "").rpartition("/")[2]
+    if total.isdigit():
+        return int(total)
+    length = headers.get("Content-Length")
+    return int(length) if length and length.isdigit() and "Content-Range" not in headers else None
+
+
+async def check_images(db: aiosqlite.Connection, checker: ImageChecker, image_urls: list[str]) -> dict:
+    """ImageCheck per URL: from image_checks while fresh, probed concurrently
+    otherwise and stored. New rows are committed before returning, so no write
+    transaction is left open while send_product talks to Telegram."""
+    now = time.time()
+    cached = {}
+    for row in await db.execute_fetchall(
+        "SELECT image_url, status, content_type, size, checked_at FROM image_checks "
+        "WHERE image_url IN (SELECT value FROM json_each(?))",
+        (json.dumps(image_urls),)
+    ):
+        check = ImageCheck(*row)
+        if check.checked_at > now - (GOOD_TTL if check.ok else BAD_TTL):
+            cached[check.url] = check
+
+    probed = await asyncio.gather(*(checker.probe(url) for url in dict.fromkeys(image_urls) if url not in cached))
+    if probed:
+        await db.executemany(
+            "INSERT OR REPLACE INTO image_checks (image_url, status, content_type, size, ok, checked_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(c.url, c.status, c.content_type, c.size, int(c.ok), c.checked_at) for c in probed]
+        )
+        await db.commit()
+    return {**cached, **{check.url: check for check in probed}}
+
+
+async def usable_images(db: aiosqlite.Connection, checker: ImageChecker, product_id: int,
+                        image_urls: list[str]) -> list[str]:
+    """The product's image URLs minus the ones Telegram would fail to fetch,
+    in order. URLs Telegram already has a file_id for are trusted as is."""
+    if not image_urls:
+        return image_urls
+    uploaded = {url for (url,) in await db.execute_fetchall(
+        "SELECT DISTINCT image_url FROM telegram_files WHERE image_url IN (SELECT value FROM json_each(?))",
+        (json.dumps(image_urls),)
+    )}
+    checks = await check_images(db, checker, [url for url in image_urls if url not in uploaded])
+    bad = [checks[url] for url in image_urls if url in checks and not checks[url].ok]
+    if bad:
+        IMAGES_EXCLUDED.inc(len(bad))
+        error_logger.warning(
+            f"🖼️ Product {product_id}: leaving out {len(bad)} of {len(image_urls)} images: "
+            + ", ".join(f"{check.url} ({check.describe()})" for check in bad)
+        )
+    excluded = {check.url for check in bad}
+    return [url for url in image_urls if url not in excluded]
+
+
+async def prefetch_images(db: aiosqlite.Connection, checker: ImageChecker, limit: int = PREFETCH_BATCH) -> int:
+    """Check the images of pending publish jobs ahead of their turn, most urgent
+    first, so send_product finds them in the cache. Returns how many were checked.
+
+    Best effort: it runs next to the publish workers on their connection, so an
+    error (say `database is locked` with several watchers) is logged and left
+    there; send_product checks whatever is missing itself.
+    """
+    now = time.time()
+    try:
+        urls = [url for (url,) in await db.execute_fetchall(
+            """
+            SELECT i.image_url
+            FROM publish_jobs j
+            JOIN product_images i ON i.product_id = j.product_id
+            LEFT JOIN image_checks c ON c.image_url = i.image_url
+            WHERE j.kind = 'publish' AND j.state = 'pending'
+              AND (c.image_url IS NULL OR c.checked_at < CASE WHEN c.ok THEN :good ELSE :bad END)
+              AND NOT EXISTS (SELECT 1 FROM telegram_files f WHERE f.image_url = i.image_url)
+            GROUP BY i.image_url
+            ORDER BY MIN(j.priority), MIN(j.next_run_at)
+            LIMIT :limit
+            """,
+            {"good": now - GOOD_TTL, "bad": now - BAD_TTL, "limit": limit}
+        )]
+        if urls:
+            await check_images(db, checker, urls)
+    except Exception as e:
+        error_logger.warning(f"⚠️ Image prefetch failed, images are checked when posting instead: {e}")
+        return 0
+    return len(urls)
+
+
+async def main():
+    """Check the given URLs (or every product image) and print the bad ones."""
+    checker = ImageChecker()
+    try:
+        async with connect() as db:
+            urls = sys.argv[1:] or [url for (url,) in await db.execute_fetchall(
+                "SELECT DISTINCT image_url FROM product_images"
+            )]
+            checks = await check_images(db, checker, urls)
+    finally:
+        await checker.close()
+    bad = [check for check in checks.values() if not check.ok]
+    for check in bad:
+        print(f"❌ {check.url}: {check.describe()}")
+    print(f"✅ {len(checks) - len(bad)} of {len(checks)} images usable.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
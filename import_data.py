@@ -1,7 +1,14 @@
 import pandas as pd
 import asyncio
 import aiosqlite
+import json
+import sys
+from itertools import islice
+from openpyxl import load_workbook
+from captions import refresh_captions
 from config import DB_NAME, EXCEL_FILE
+from database import PRUNE_FILE_IDS_SQL, PRUNE_IMAGE_CHECKS_SQL, connect
+from notify import notify_watcher
 
 
 COLUMN_MAP = {
@@ -17,54 +24,256 @@ COLUMN_MAP = {
     "Изображения": "image"  # Now mapping images column
 }
 
-async def main():
-    # Clear table first
-    async with aiosqlite.connect(DB_NAME) as db:
+# Columns compared and upserted by the incremental import, in products order
+PRODUCT_COLUMNS = ["name", "description", "price", "old_price", "stock", "category", "url", "visible"]
+
+CHUNK_SIZE = 5000  # sheet rows converted and written per batch
+
+# Safe for a single bulk transaction: a crash rolls back to the previous catalog
+BULK_PRAGMAS = [
+    "PRAGMA synchronous = OFF",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",  # 64 MB
+]
+
+
+def convert_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    """Turn raw sheet columns into product columns, one whole column at a time."""
+    for column in COLUMN_MAP.values():
+        if column not in df.columns:
+            df[column] = None
+
+    df["visible"] = (df["visible"] == "выставлен").astype(int)
+    df["images"] = df["image"].fillna("").astype(str).str.split()
+    has_article = df["article"].notna()
+    df["article"] = df["article"].astype(object)
+    df.loc[has_article, "article"] = df.loc[has_article, "article"].astype(str)
+
+    df = df[["article"] + PRODUCT_COLUMNS + ["images"]].astype(object)
+    return df.where(pd.notnull(df), None)
+
+
+def read_chunks(path: str = EXCEL_FILE, chunk_size: int = CHUNK_SIZE):
+    """Stream the first sheet of the workbook as converted DataFrames of chunk_size rows."""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [COLUMN_MAP.get(name, name) for name in header]
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch:
+                break
+            yield convert_chunk(pd.DataFrame(batch, columns=columns))
+    finally:
+        workbook.close()
+
+
+async def begin_bulk(db: aiosqlite.Connection, pragmas: list[str] = BULK_PRAGMAS):
+    for pragma in pragmas:
+        await db.execute(pragma)
+    await db.execute("BEGIN IMMEDIATE")
+
+
+async def next_product_id(db: aiosqlite.Connection) -> int:
+    """First free id, so images can be inserted without a lastrowid per product."""
+    async with db.execute(
+        "SELECT MAX(IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'products'), 0),"
+        " IFNULL((SELECT MAX(id) FROM products), 0))"
+    ) as cursor:
+        (last_id,) = await cursor.fetchone()
+    return last_id + 1
+
+
+async def insert_products(db: aiosqlite.Connection, df: pd.DataFrame, first_id: int) -> int:
+    """executemany the rows of df with ids from first_id on. Returns the next free id."""
+    ids = range(first_id, first_id + len(df))
+    await db.executemany(
+        """
+        INSERT INTO products
+        (id, article, name, description, price, old_price, stock, category, url, visible)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        zip(ids, *(df[c] for c in ["article"] + PRODUCT_COLUMNS))
+    )
+    await db.executemany(
+        "INSERT INTO product_images (product_id, image_url) VALUES (?, ?)",
+        ((product_id, url) for product_id, urls in zip(ids, df["images"]) for url in urls)
+    )
+    return first_id + len(df)
+
+
+async def replace_all(chunks, db_name: str = DB_NAME):
+    """Old behaviour: wipe both tables and insert everything with fresh ids."""
+    total = 0
+    async with connect(db_name) as db:
+        await begin_bulk(db)
         await db.execute("DELETE FROM products;")
         await db.execute("DELETE FROM product_images;")  # also clear images
-        await db.commit()
         print("✅ Cleared 'products' and 'product_images' tables.")
 
-    # Import new data
-    df = pd.read_excel(EXCEL_FILE)
-    df = df.rename(columns=COLUMN_MAP)
-    df = df[[c for c in COLUMN_MAP.values() if c in df.columns]]
-    df = df.where(pd.notnull(df), None)
-
-    async with aiosqlite.connect(DB_NAME) as db:
-        for _, row in df.iterrows():
-            cursor = await db.execute(
-                """
-                INSERT INTO products
-                (article, name, description, price, old_price, stock, category, url, visible)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    row.get("article"),
-                    row.get("name"),
-                    row.get("description"),
-                    row.get("price"),
-                    row.get("old_price"),
-                    row.get("stock"),
-                    row.get("category"),
-                    row.get("url"),
-                    1 if row.get("visible") == "выставлен" else 0
+        product_id = await next_product_id(db)
+        for df in chunks:
+            product_id = await insert_products(db, df, product_id)
+            total += len(df)
+        await db.execute(PRUNE_FILE_IDS_SQL)
+        await db.execute(PRUNE_IMAGE_CHECKS_SQL)
+        rendered, _ = await refresh_captions(db)
+        await db.commit()
+    print(f"✅ Imported {total} products with their images, {rendered} captions rendered.")
+    return total
+
+
+async def stage_rows(db: aiosqlite.Connection, chunks):
+    """Load the sheet into the temp table import_rows, one row per article; a
+    later row of an article replaces the earlier one. Returns (rows read,
+    rows skipped without article)."""
+    total = skipped = 0
+    columns = ["article"] + PRODUCT_COLUMNS + ["images"]
+    await db.execute(f"CREATE TEMP TABLE import_rows (article PRIMARY KEY, {', '.join(columns[1:])})")
+    for df in chunks:
+        total += len(df)
+        has_article = df["article"].notna()
+        skipped += int((~has_article).sum())  # can't be matched on the next import
+        df = df[has_article]
+        await db.executemany(
+            f"INSERT OR REPLACE INTO import_rows ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            zip(*(df[c] for c in columns[:-1]), map(json.dumps, df["images"]))
+        )
+    return total, skipped
+
+
+async def iter_staged(db: aiosqlite.Connection, batch_size: int = CHUNK_SIZE):
+    """Read import_rows back in sheet order, as DataFrames like read_chunks yields."""
+    columns = ["article"] + PRODUCT_COLUMNS + ["images"]
+    after = 0
+    while True:
+        rows = await db.execute_fetchall(
+            f"SELECT rowid, {', '.join(columns)} FROM import_rows WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (after, batch_size)
+        )
+        if not rows:
+            return
+        after = rows[-1][0]
+        df = pd.DataFrame([row[1:] for row in rows], columns=columns, dtype=object)
+        df["images"] = df["images"].map(json.loads)
+        yield df
+
+
+async def import_incremental(chunks, db_name: str = DB_NAME):
+    """Upsert products by article in one transaction.
+
+    Only columns that differ are written and image lists are replaced only when
+    they differ, so the change-log triggers fire for exactly the changed
+    products. Articles missing from the file are hidden, not deleted, so their
+    ids and product_messages rows survive. Re-importing an unchanged file
+    writes nothing.
+
+    An article listed more than once is one product: the last row wins. The
+    sheet is staged in a temp table keyed by article first, so even duplicates
+    in different chunks are diffed only once, without holding the sheet in memory.
+    """
+    inserted = updated = images_changed = 0
+
+    async with connect(db_name) as db:
+        # The staged sheet spills to a temp file instead of growing in RAM
+        await begin_bulk(db, BULK_PRAGMAS + ["PRAGMA temp_store = FILE"])
+
+        existing = {}
+        async with db.execute(
+            f"SELECT id, article, {', '.join(PRODUCT_COLUMNS)} FROM products WHERE article IS NOT NULL"
+        ) as cursor:
+            stale_copies = []  # extra rows of one article, left by imports before deduplication
+            async for row in cursor:
+                if row[1] in existing:
+                    stale_copies.append(existing[row[1]])
+                existing[row[1]] = (row[0], row[2:])
+
+        existing_images = {}
+        async with db.execute("SELECT product_id, image_url FROM product_images ORDER BY id") as cursor:
+            async for product_id, image_url in cursor:
+                existing_images.setdefault(product_id, []).append(image_url)
+
+        total, skipped = await stage_rows(db, chunks)
+        async with db.execute("SELECT COUNT(*) FROM import_rows") as cursor:
+            (articles,) = await cursor.fetchone()
+        duplicates = total - skipped - articles
+
+        next_id = await next_product_id(db)
+        async for df in iter_staged(db):
+            is_new = ~df["article"].isin(existing.keys())
+            next_id = await insert_products(db, df[is_new], next_id)
+            inserted += int(is_new.sum())
+
+            # Group updates by the set of changed columns: one executemany per shape
+            updates = {}
+            new_images = []
+            for article, images, *values in df[~is_new][["article", "images"] + PRODUCT_COLUMNS].itertuples(
+                index=False, name=None
+            ):
+                product_id, current = existing[article]
+                changed = tuple(c for c, old, new in zip(PRODUCT_COLUMNS, current, values) if old != new)
+                if changed:
+                    updates.setdefault(changed, []).append(
+                        [new for c, new in zip(PRODUCT_COLUMNS, values) if c in changed] + [product_id]
+                    )
+                if existing_images.get(product_id, []) != images:
+                    new_images.append((product_id, images))
+
+            for changed, params in updates.items():
+                await db.executemany(
+                    f"UPDATE products SET {', '.join(f'{c} = ?' for c in changed)} WHERE id = ?", params
                 )
+                updated += len(params)
+
+            await db.executemany(
+                "DELETE FROM product_images WHERE product_id = ?", ((pid,) for pid, _ in new_images)
             )
-            product_id = cursor.lastrowid
-
-            # Insert images
-            image_urls = str(row.get("image") or "").split()
-            for url in image_urls:
-                await db.execute(
-                    "INSERT INTO product_images (product_id, image_url) VALUES (?, ?)",
-                    (product_id, url)
-                )
+            await db.executemany(
+                "INSERT INTO product_images (product_id, image_url) VALUES (?, ?)",
+                ((pid, url) for pid, urls in new_images for url in urls)
+            )
+            images_changed += len(new_images)
+
+        # Soft-hide articles that are no longer in the file, and extra copies of one article
+        cursor = await db.execute(
+            """
+            UPDATE products SET visible = 0
+            WHERE article IS NOT NULL AND visible
+              AND NOT EXISTS (SELECT 1 FROM import_rows r WHERE r.article = products.article)
+            """
+        )
+        hidden = cursor.rowcount
+        cursor = await db.executemany(
+            "UPDATE products SET visible = 0 WHERE id = ? AND visible", ((pid,) for pid, _ in stale_copies)
+        )
+        hidden += cursor.rowcount
+        await db.execute("DROP TABLE import_rows")
+
+        await db.execute(PRUNE_FILE_IDS_SQL)
+        await db.execute(PRUNE_IMAGE_CHECKS_SQL)
+        # The watcher then publishes without rendering anything
+        rendered, pruned = await refresh_captions(db)
         await db.commit()
-        print(f"✅ Imported {len(df)} products with their images.")
 
+    print(
+        f"✅ Incremental import of {total} rows: {inserted} new, {updated} updated, "
+        f"{images_changed} with new images, {hidden} hidden, {skipped} skipped without article, "
+        f"{duplicates} duplicate rows merged; "
+        f"{rendered} captions rendered, {pruned} pruned."
+    )
+    return total
 
-if __name__ == "__main__":
-    asyncio.run(main())
+
+async def main():
+    if "--replace" in sys.argv:
+        await replace_all(read_chunks())
+    else:
+        await import_incremental(read_chunks())
+    notify_watcher()
 
 
+if __name__ == "__main__":
+    asyncio.run(main())
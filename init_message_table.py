@@ -1,17 +1,10 @@
 import asyncio
-import aiosqlite
-from config import DB_NAME
+from database import init_db
 
 async def init():
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS product_messages (
-                product_id INTEGER,
-                message_id INTEGER
-            );
-        """)
-        await db.commit()
-        print("✅ Table 'product_messages' created or already exists.")
+    # product_messages now lives in database.init_db together with its index
+    await init_db()
+    print("✅ Table 'product_messages' created or already exists.")
 
 if __name__ == "__main__":
     asyncio.run(init())
@@ -0,0 +1,386 @@
+# job_queue.py
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import time
+import uuid
+from typing import NamedTuple
+
+import aiosqlite
+
+from database import connect
+from notify import notify_watcher
+
+MAX_ATTEMPTS = 6          # a job failing this many times goes to dead_jobs
+BACKOFF_BASE = 10         # seconds before the first retry, doubled per attempt
+BACKOFF_CAP = 30 * 60     # longest wait between two attempts
+LEASE_SECONDS = 60        # a running job whose lease isn't renewed by then is handed out again
+LEASE_RENEW_INTERVAL = 15  # seconds between heartbeats / lease renewals of a live watcher
+AGING_SECONDS = 5 * 60    # a waiting job moves up one priority level per this many seconds
+AGING_BATCH = 5000        # jobs raised per age_jobs call at most, to keep its write short
+ROUTE_BATCH = 1000        # new jobs assigned their channel per claim at most
+CLAIM_WINDOW = 50         # most urgent due jobs a claim spreads over the categories
+
+# Lower runs first. Under load the changes customers notice reach the channel
+# first; aging keeps a backlog of low-priority refreshes from starving.
+PRIORITY_REMOVE = 0       # out of stock, hidden or deleted
+PRIORITY_PRICE = 1
+PRIORITY_CONTENT = 2      # name, description, images, new posts
+PRIORITY_COSMETIC = 3     # manual refreshes and reconciliation drift
+PRIORITY_NAMES = {
+    PRIORITY_REMOVE: "remove",
+    PRIORITY_PRICE: "price",
+    PRIORITY_CONTENT: "content",
+    PRIORITY_COSMETIC: "cosmetic",
+}
+
+
+class Job(NamedTuple):
+    id: int
+    product_id: int
+    kind: str
+    attempts: int
+    generation: int
+    owner: str = None
+
+
+def new_owner() -> str:
+    """Lease owner id for one watcher run: host, pid and a random part, so a
+    restart in the same process doesn't inherit its predecessor's leases."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def backoff(attempts: int) -> float:
+    """Exponential backoff with jitter: half fixed, half random."""
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+async def enqueue_jobs(db: aiosqlite.Connection, kind: str, product_ids: list[int], delay: float = 0,
+                       priority: int = None):
+    """Queue `kind` jobs for the products. Doesn't commit, so callers can make it
+    part of a bigger transaction.
+
+    A product has at most one job: a newer decision replaces the kind and its
+    priority, resets the attempts and makes the job due now. Another change of
+    the same kind can only raise its priority, and the job keeps its age. The
+    job is routed again (see route_jobs), as the category may have moved.
+    """
+    if priority is None:
+        priority = PRIORITY_REMOVE if kind == "delete" else PRIORITY_CONTENT
+    now = time.time()
+    await db.executemany(
+        """
+        INSERT INTO publish_jobs (product_id, kind, priority, enqueued_at, aged_at, next_run_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(product_id) DO UPDATE SET
+            priority = CASE WHEN kind = excluded.kind THEN MIN(priority, excluded.priority)
+                            ELSE excluded.priority END,
+            aged_at = CASE WHEN kind = excluded.kind THEN aged_at ELSE excluded.aged_at END,
+            kind = excluded.kind,
+            channel = NULL,
+            attempts = 0,
+            generation = generation + 1,
+            next_run_at = excluded.next_run_at,
+            last_error = NULL
+        """,
+        [(product_id, kind, priority, now, now, now + delay) for product_id in product_ids]
+    )
+
+
+async def enqueue_prioritized(db: aiosqlite.Connection, kind: str, jobs: list[tuple[int, int]]):
+    """enqueue_jobs for (product_id, priority) pairs. Doesn't commit."""
+    for priority in sorted({priority for _, priority in jobs}):
+        await enqueue_jobs(db, kind, [pid for pid, p in jobs if p == priority], priority=priority)
+
+
+async def age_jobs(db: aiosqlite.Connection, limit: int = AGING_BATCH) -> int:
+    """Raise waiting jobs one priority level per AGING_SECONDS since they were
+    queued or last raised, so a backlog of low-priority refreshes can't starve.
+    Only jobs due for a raise are visited, at most `limit` of them, oldest
+    first. Commits; returns how many moved."""
+    cursor = await db.execute(
+        """
+        UPDATE publish_jobs
+        SET priority = MAX(0, priority - CAST((:now - aged_at) / :aging AS INTEGER)),
+            aged_at = aged_at + CAST((:now - aged_at) / :aging AS INTEGER) * :aging
+        WHERE id IN (
+            SELECT id FROM publish_jobs INDEXED BY idx_publish_jobs_aging
+            WHERE priority > 0 AND aged_at <= :now - :aging AND state = 'pending'
+            ORDER BY aged_at
+            LIMIT :limit
+        )
+        """,
+        {"now": time.time(), "aging": AGING_SECONDS, "limit": limit}
+    )
+    await db.commit()
+    return cursor.rowcount
+
+
+async def route_jobs(db: aiosqlite.Connection, routes: dict[str, str], default_channel: str,
+                     limit: int = ROUTE_BATCH) -> int:
+    """Store the channel new publish jobs go to (category -> channel in
+    `routes`, `default_channel` otherwise), so claims for one channel are an
+    index range. Doesn't commit; returns how many were routed."""
+    cursor = await db.execute(
+        """
+        UPDATE publish_jobs
+        SET channel = IFNULL(
+            (SELECT value FROM json_each(:routes)
+             WHERE key = (SELECT category FROM products p WHERE p.id = publish_jobs.product_id)),
+            :default
+        )
+        WHERE id IN (
+            SELECT id FROM publish_jobs INDEXED BY idx_publish_jobs_unrouted
+            WHERE kind = 'publish' AND channel IS NULL
+            LIMIT :limit
+        )
+        """,
+        {"routes": json.dumps(routes or {}), "default": default_channel, "limit": limit}
+    )
+    return cursor.rowcount
+
+
+async def forget_routes(db: aiosqlite.Connection):
+    """Route every job again on its next claim, e.g. after the routes file changed."""
+    await db.execute("UPDATE publish_jobs SET channel = NULL WHERE channel IS NOT NULL")
+    await db.commit()
+
+
+# Hands jobs whose owner stopped renewing the lease (it died) back to the queue
+RECLAIM_SQL = """
+    UPDATE publish_jobs SET state = 'pending', lease_until = NULL, lease_owner = NULL
+    WHERE kind = :kind AND state = 'running' AND lease_until < :now
+"""
+
+# Due jobs of one channel (see route_jobs; deletes have none). The CLAIM_WINDOW
+# most urgent ones (stored priority, see age_jobs, then due time) are read in
+# idx_publish_jobs_claim order, so a claim visits a few rows whatever the
+# backlog; the planner would rather range-scan idx_publish_jobs_due and sort.
+# Among those, categories with the fewest jobs running right now go first, so
+# one big category can't take every worker.
+CLAIM_SQL = """
+    UPDATE publish_jobs
+    SET state = 'running', attempts = attempts + 1, lease_until = :lease_until, lease_owner = :owner
+    WHERE id IN (
+        WITH candidates AS (
+            SELECT j.id, j.priority, j.next_run_at, p.category
+            FROM publish_jobs j INDEXED BY idx_publish_jobs_claim
+            LEFT JOIN products p ON p.id = j.product_id
+            WHERE j.kind = :kind AND j.state = 'pending' AND j.channel IS :channel AND j.next_run_at <= :now
+            ORDER BY j.priority, j.next_run_at
+            LIMIT :window
+        ), busy AS (
+            SELECT p.category, COUNT(*) AS running
+            FROM publish_jobs r
+            JOIN products p ON p.id = r.product_id
+            WHERE r.kind = :kind AND r.state = 'running'
+            GROUP BY p.category
+        )
+        SELECT c.id
+        FROM candidates c
+        LEFT JOIN busy b ON b.category IS c.category
+        ORDER BY c.priority, IFNULL(b.running, 0), c.next_run_at
+        LIMIT :limit
+    )
+    RETURNING id, product_id, kind, attempts, generation, lease_owner
+"""
+
+
+async def claim_jobs(db: aiosqlite.Connection, kind: str, limit: int, channel: str = None,
+                     routes: dict[str, str] = None, default_channel: str = None, owner: str = None) -> list[Job]:
+    """Lease up to `limit` due jobs of `kind` to `owner`, including ones whose
+    lease ran out (their owner died), in the order of CLAIM_SQL. One UPDATE, so
+    two processes never get the same job.
+
+    With `channel`, only products routed there (category -> channel in
+    `routes`, `default_channel` otherwise) are claimed; without, only jobs
+    that have no channel, which is every delete.
+    """
+    now = time.time()
+    if channel is not None:
+        await route_jobs(db, routes, default_channel)
+    await db.execute(RECLAIM_SQL, {"kind": kind, "now": now})
+    # Executed and drained in one step: the workers share the writer connection,
+    # and another one committing while this UPDATE is half-stepped would fail.
+    rows = await db.execute_fetchall(
+        CLAIM_SQL,
+        {"lease_until": now + LEASE_SECONDS, "now": now, "kind": kind, "channel": channel,
+         "window": max(limit, CLAIM_WINDOW), "limit": limit, "owner": owner}
+    )
+    jobs = [Job(*row) for row in rows]
+    await db.commit()
+    return jobs
+
+
+async def seconds_until_next_job(db: aiosqlite.Connection):
+    """Seconds until the earliest pending job or expiring lease is due, None if the queue is empty."""
+    async with db.execute(
+        """
+        SELECT MIN(due) FROM (
+            SELECT MIN(next_run_at) AS due FROM publish_jobs WHERE state = 'pending'
+            UNION ALL
+            SELECT MIN(lease_until) FROM publish_jobs WHERE state = 'running'
+        )
+        """
+    ) as cursor:
+        (due,) = await cursor.fetchone()
+    return None if due is None else due - time.time()
+
+
+async def queue_depth(db: aiosqlite.Connection):
+    """(kind, priority, state, jobs, seconds the oldest has waited) per group of the queue."""
+    async with db.execute(
+        """
+        SELECT kind, priority, state, COUNT(*), ? - MIN(IFNULL(enqueued_at, next_run_at))
+        FROM publish_jobs
+        GROUP BY kind, priority, state
+        ORDER BY priority, kind, state
+        """,
+        (time.time(),)
+    ) as cursor:
+        return await cursor.fetchall()
+
+
+def format_queue_depth(depth) -> str:
+    return ", ".join(
+        f"{kind}/{PRIORITY_NAMES.get(priority, priority)} {state}: {jobs} (oldest {waited:.0f}s)"
+        for kind, priority, state, jobs, waited in depth
+    ) or "empty"
+
+
+async def complete_job(db: aiosqlite.Connection, job: Job):
+    """Drop a finished job, unless it was re-enqueued while it ran. A job whose
+    lease went to another watcher meanwhile is left to that one."""
+    cursor = await db.execute(
+        "DELETE FROM publish_jobs WHERE id = ? AND generation = ? AND lease_owner IS ?",
+        (job.id, job.generation, job.owner)
+    )
+    if cursor.rowcount == 0:
+        await db.execute(
+            "UPDATE publish_jobs SET state = 'pending', lease_until = NULL, lease_owner = NULL "
+            "WHERE id = ? AND lease_owner IS ?",
+            (job.id, job.owner)
+        )
+    await db.commit()
+
+
+async def fail_job(db: aiosqlite.Connection, job: Job, error: str):
+    """Schedule a retry with backoff, or move the job to dead_jobs when it's out of attempts."""
+    if job.attempts >= MAX_ATTEMPTS:
+        cursor = await db.execute(
+            "DELETE FROM publish_jobs WHERE id = ? AND generation = ? AND lease_owner IS ?",
+            (job.id, job.generation, job.owner)
+        )
+        if cursor.rowcount:
+            await db.execute(
+                "INSERT INTO dead_jobs (product_id, kind, attempts, last_error) VALUES (?, ?, ?, ?)",
+                (job.product_id, job.kind, job.attempts, error)
+            )
+            await db.commit()
+            return False
+
+    await db.execute(
+        """
+        UPDATE publish_jobs
+        SET state = 'pending', lease_until = NULL, lease_owner = NULL, last_error = ?,
+            next_run_at = CASE WHEN generation = ? THEN ? ELSE next_run_at END
+        WHERE id = ? AND lease_owner IS ?
+        """,
+        (error, job.generation, time.time() + backoff(job.attempts), job.id, job.owner)
+    )
+    await db.commit()
+    return True
+
+
+async def heartbeat(db: aiosqlite.Connection, owner: str) -> int:
+    """Renew `owner`'s job leases and its watchers row; forget watchers that
+    stopped beating. Returns how many watchers are alive, this one included."""
+    now = time.time()
+    await db.execute(
+        "UPDATE publish_jobs SET lease_until = ? WHERE state = 'running' AND lease_owner = ?",
+        (now + LEASE_SECONDS, owner)
+    )
+    await db.execute(
+        """
+        INSERT INTO watchers (owner, started_at, heartbeat_at) VALUES (?, ?, ?)
+        ON CONFLICT(owner) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+        """,
+        (owner, now, now)
+    )
+    await db.execute("DELETE FROM watchers WHERE heartbeat_at < ?", (now - LEASE_SECONDS,))
+    async with db.execute("SELECT COUNT(*) FROM watchers") as cursor:
+        (alive,) = await cursor.fetchone()
+    await db.commit()
+    return alive
+
+
+async def release_jobs(db: aiosqlite.Connection, owner: str):
+    """Hand `owner`'s running jobs back right away (clean shutdown), without
+    counting the interrupted attempt, and drop its watchers row."""
+    await db.execute(
+        """
+        UPDATE publish_jobs
+        SET state = 'pending', lease_until = NULL, lease_owner = NULL, attempts = MAX(attempts - 1, 0)
+        WHERE state = 'running' AND lease_owner = ?
+        """,
+        (owner,)
+    )
+    await db.execute("DELETE FROM watchers WHERE owner = ?", (owner,))
+    await db.commit()
+
+
+async def list_watchers(db: aiosqlite.Connection):
+    async with db.execute(
+        """
+        SELECT w.owner, w.started_at, w.heartbeat_at,
+               (SELECT COUNT(*) FROM publish_jobs j WHERE j.state = 'running' AND j.lease_owner = w.owner)
+        FROM watchers w ORDER BY w.started_at
+        """
+    ) as cursor:
+        return await cursor.fetchall()
+
+
+async def list_dead_jobs(db: aiosqlite.Connection):
+    async with db.execute(
+        "SELECT id, product_id, kind, attempts, last_error, failed_at FROM dead_jobs ORDER BY id"
+    ) as cursor:
+        return await cursor.fetchall()
+
+
+async def replay_dead_jobs(db: aiosqlite.Connection, dead_ids: list[int] = None):
+    """Put dead jobs (all of them, or the given dead_jobs ids) back in the queue."""
+    dead = [row for row in await list_dead_jobs(db) if dead_ids is None or row[0] in dead_ids]
+    for kind in {row[2] for row in dead}:
+        await enqueue_jobs(db, kind, [row[1] for row in dead if row[2] == kind])
+    await db.executemany("DELETE FROM dead_jobs WHERE id = ?", [(row[0],) for row in dead])
+    await db.commit()
+    return len(dead)
+
+
+async def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "dead"
+    async with connect() as db:
+        if command == "depth":
+            print(format_queue_depth(await queue_depth(db)))
+        elif command == "watchers":
+            now = time.time()
+            for owner, started_at, heartbeat_at, running in await list_watchers(db):
+                print(f"{owner}: up {now - started_at:.0f}s, last beat {now - heartbeat_at:.0f}s ago, "
+                      f"{running} jobs running")
+        elif command == "dead":
+            for dead_id, product_id, kind, attempts, last_error, failed_at in await list_dead_jobs(db):
+                print(f"#{dead_id} product {product_id} {kind}: {attempts} attempts, {failed_at} — {last_error}")
+        elif command == "replay":
+            ids = [int(arg) for arg in sys.argv[2:]] or None
+            print(f"✅ Replayed {await replay_dead_jobs(db, ids)} dead jobs.")
+            notify_watcher()
+        else:
+            print("Usage: python job_queue.py [depth | watchers | dead | replay [dead_job_id ...]]")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+# log_setup.py
+import atexit
+import copy
+import json
+import logging
+import queue
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Record attributes copied into the JSON line when a call passes them in `extra`
+STRUCTURED_FIELDS = ("product_id", "operation", "latency_ms", "chat_id", "count", "attempt", "suppressed")
+SAMPLE_INTERVAL = 60  # seconds: a sampled message is written at most once per this, per key
+
+CONSOLE_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+
+def fields(product_id: int = None, operation: str = None, started: float = None, **more) -> dict:
+    """`extra` for a structured record; `started` is a time.perf_counter() value."""
+    extra = {key: value for key, value in more.items() if value is not None}
+    if product_id is not None:
+        extra["product_id"] = product_id
+    if operation is not None:
+        extra["operation"] = operation
+    if started is not None:
+        extra["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return extra
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and the structured fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key in STRUCTURED_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                line[key] = value
+        if record.exc_text:
+            line["exc"] = record.exc_text
+        return json.dumps(line, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Lets a record with extra={"sample": key} through once per SAMPLE_INTERVAL.
+
+    The one that gets through carries how many were dropped since in `suppressed`.
+    Records without a sample key always pass.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self.windows = {}  # key -> [last written at, suppressed since]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        window = self.windows.setdefault(key, [float("-inf"), 0])
+        if record.created - window[0] < self.interval:
+            window[1] += 1
+            return False
+        if window[1]:
+            record.suppressed = window[1]
+        self.windows[key] = [record.created, 0]
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    # The stock prepare() merges the traceback into the message; keep it apart
+    # so the JSON line has it in its own field.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+_listener = None
+
+
+def setup_logging(bot_log: str = "bot.log", error_log: str = "errors.log", console: bool = True):
+    """Route the "bot" and "errors" loggers through a queue.
+
+    Callers (coroutines included) only put records on the queue; a listener
+    thread does the file and console I/O and the rollovers. bot.log and
+    errors.log get JSON lines, the console the usual human-readable format.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    bot_handler = RotatingFileHandler(bot_log, maxBytes=2 * 1024 * 1024, backupCount=5, encoding="utf-8")
+    bot_handler.addFilter(logging.Filter("bot"))
+    error_handler = RotatingFileHandler(error_log, maxBytes=2 * 1024 * 1024, backupCount=3, encoding="utf-8")
+    error_handler.addFilter(logging.Filter("errors"))
+    handlers = [bot_handler, error_handler]
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter())
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        handlers.append(console_handler)
+
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(SampleFilter())
+
+    bot_logger = logging.getLogger("bot")
+    bot_logger.setLevel(logging.INFO)
+    error_logger = logging.getLogger("errors")
+    error_logger.setLevel(logging.WARNING)
+    for logger in (bot_logger, error_logger):
+        logger.addHandler(queue_handler)
+        logger.propagate = False  # error logs stay out of bot.log and vice versa
+
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out what is still queued and close the files."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
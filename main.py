@@ -118,259 +118,700 @@
 # if __name__ == "__main__":
 #     asyncio.run(send_test_message())
 import logging
-from logging.handlers import RotatingFileHandler
 
 import asyncio
 import aiosqlite
-import re
+import hashlib
+import json
+import time
 from aiogram import Bot, types
-from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
-from config import DB_NAME, BOT_TOKEN, CHANNEL_ID
-
-
-CHECK_INTERVAL = 5  # seconds between watcher loops
-DELAY_BETWEEN_PRODUCTS = 1.5  # seconds between sending each product
-CONCURRENT_LIMIT = 1  # safest for SendMediaGroup-heavy posts
-MAX_RETRIES = 3  # retry attempts for flood control
+from aiogram.exceptions import TelegramBadRequest
+from captions import get_caption
+from database import begin_immediate, connect, connections
+from image_checks import ImageChecker, prefetch_images, usable_images
+from job_queue import (
+    LEASE_RENEW_INTERVAL, PRIORITY_COSMETIC, PRIORITY_NAMES, Job, age_jobs, claim_jobs, complete_job,
+    enqueue_jobs, enqueue_prioritized, fail_job, forget_routes, format_queue_depth, heartbeat, new_owner,
+    queue_depth, release_jobs, seconds_until_next_job,
+)
+from log_setup import fields, setup_logging
+from metrics import BACKLOG, DB_SECONDS, IMAGES_PER_POST, PASS_SECONDS, PUBLISH_SECONDS, start_metrics
+from notify import Waker
+from reconcile import reconcile_step
+from rate_limiter import SendScheduler
+from routing import Channel, Router, load_router
+
+
+MIN_POLL_INTERVAL = 1  # seconds between watcher passes while there is work
+MAX_POLL_INTERVAL = 30  # idle passes back off up to this when no wake-up arrives
+CONCURRENT_LIMIT = 4  # products in flight per channel; the pace itself is set by the scheduler
+DELETE_BATCH_SIZE = 100  # deleteMessages accepts at most 100 ids per call
+JOBS_PER_PASS = 20  # publish jobs per channel run before the watcher reads the change log again (and re-prioritizes)
+CLAIM_BATCH_SIZE = 2  # publish jobs a worker leases per claim, to take the write lock less often
+CHANGE_BATCH_SIZE = 1000  # product_changes rows consumed per watcher pass
+HIGH_WATER_MARK_KEY = "product_changes_hwm"  # watcher_state key of the last consumed change
 
 # --- Logging Setup ---
+# Records are only queued here; a listener thread writes bot.log / errors.log
+# (JSON lines) and the console, so logging never blocks the event loop.
+setup_logging()
+bot_logger = logging.getLogger("bot")
+error_logger = logging.getLogger("errors")
 
-# Formatter
-formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+# Every Bot API call goes through its bot's scheduler, see rate_limiter.py. Each
+# token has its own global budget and every chat its own bucket within it.
+schedulers: dict[int, SendScheduler] = {}
 
-# General bot logger — INFO and above
-bot_logger = logging.getLogger("bot")
-bot_logger.setLevel(logging.INFO)
 
-bot_handler = RotatingFileHandler(
-    filename="bot.log",
-    maxBytes=2 * 1024 * 1024,
-    backupCount=5,
-    encoding="utf-8"
-)
-bot_handler.setFormatter(formatter)
-bot_logger.addHandler(bot_handler)
+# Probes product image URLs before they go to Telegram, see image_checks.py
+image_checker = ImageChecker()
 
-# Error logger — WARNING and above
-error_logger = logging.getLogger("errors")
-error_logger.setLevel(logging.WARNING)
 
-error_handler = RotatingFileHandler(
-    filename="errors.log",
-    maxBytes=2 * 1024 * 1024,
-    backupCount=3,
-    encoding="utf-8"
-)
-error_handler.setFormatter(formatter)
-error_logger.addHandler(error_handler)
+def scheduler_for(bot: Bot) -> SendScheduler:
+    scheduler = schedulers.get(bot.id)
+    if scheduler is None:
+        scheduler = schedulers[bot.id] = SendScheduler()
+    return scheduler
+
 
-# ✅ Critical line: prevent error logs from going to bot.log
-error_logger.propagate = False
+# Hits and misses of the telegram_files cache since start, logged once per pass
+file_id_stats = {"hits": 0, "misses": 0}
 
-# Console output
-console = logging.StreamHandler()
-console.setFormatter(formatter)
-bot_logger.addHandler(console)
-error_logger.addHandler(console)
 
-# --- Test ---
-# bot_logger.info("INFO: bot logger working")
-# error_logger.error("ERROR: error logger working")
+async def get_file_ids(db: aiosqlite.Connection, bot: Bot, image_urls: list[str]):
+    """Return {image_url: file_id} for the URLs this bot has uploaded before."""
+    async with db.execute(
+        "SELECT image_url, file_id FROM telegram_files "
+        "WHERE bot_id = ? AND image_url IN (SELECT value FROM json_each(?))",
+        (bot.id, json.dumps(image_urls))
+    ) as cursor:
+        file_ids = dict(await cursor.fetchall())
+    file_id_stats["hits"] += len(file_ids)
+    file_id_stats["misses"] += len(set(image_urls)) - len(file_ids)
+    return file_ids
 
 
+async def save_file_ids(db: aiosqlite.Connection, bot: Bot, pairs: list[tuple[str, str]]):
+    if not pairs:
+        return
+    await db.executemany(
+        "INSERT OR REPLACE INTO telegram_files (image_url, bot_id, file_id) VALUES (?, ?, ?)",
+        [(url, bot.id, file_id) for url, file_id in pairs]
+    )
+    await db.commit()
 
-def clean_html(text: str) -> str:
-    if not text:
-        return ""
-    text = re.sub(r'</?p>', '\n', text)
-    text = re.sub(r'<br\s*/?>', '\n', text)
-    text = re.sub(r'<.*?>', '', text)
-    return text.strip()
 
+async def forget_file_ids(db: aiosqlite.Connection, bot: Bot, image_urls: list[str]):
+    await db.execute(
+        "DELETE FROM telegram_files WHERE bot_id = ? AND image_url IN (SELECT value FROM json_each(?))",
+        (bot.id, json.dumps(image_urls))
+    )
+    await db.commit()
 
-async def send_images(bot: Bot, chat_id: str, image_urls: list[str], caption: str):
-    if len(image_urls) == 1:
-        msg = await bot.send_photo(chat_id=chat_id, photo=image_urls[0], caption=caption, parse_mode="HTML")
-        return [msg.message_id]
-    else:
-        media = [types.InputMediaPhoto(media=image_urls[0], caption=caption, parse_mode="HTML")]
-        for url in image_urls[1:]:
-            media.append(types.InputMediaPhoto(media=url))
-        messages = await bot.send_media_group(chat_id=chat_id, media=media)
-        return [m.message_id for m in messages]
 
+def photo_file_id(message):
+    """file_id of the largest size of a sent photo, None for anything else."""
+    photo = getattr(message, "photo", None)
+    return photo[-1].file_id if photo else None
 
-async def delete_previous_messages(db: aiosqlite.Connection, bot: Bot, product_id: int):
-    async with db.execute("SELECT message_id FROM product_messages WHERE product_id = ?", (product_id,)) as cur:
-        rows = await cur.fetchall()
 
-    for (msg_id,) in rows:
+async def send_album(bot: Bot, chat_id: str, photos: list[str], caption: str):
+    """Send photos (URLs or file_ids) as one photo or an album; returns the sent messages."""
+    if len(photos) == 1:
+        msg = await scheduler_for(bot).call(chat_id, 1, lambda: bot.send_photo(
+            chat_id=chat_id, photo=photos[0], caption=caption, parse_mode="HTML"
+        ))
+        return [msg]
+    else:
+        media = [types.InputMediaPhoto(media=photos[0], caption=caption, parse_mode="HTML")]
+        for photo in photos[1:]:
+            media.append(types.InputMediaPhoto(media=photo))
+        # An album is charged as one message per item
+        return await scheduler_for(bot).call(chat_id, len(media), lambda: bot.send_media_group(
+            chat_id=chat_id, media=media
+        ))
+
+
+async def send_images(bot: Bot, db: aiosqlite.Connection, chat_id: str, image_urls: list[str], caption: str):
+    """Post the images, reusing cached file_ids so Telegram doesn't refetch them from the CDN."""
+    file_ids = await get_file_ids(db, bot, image_urls)
+    try:
+        messages = await send_album(bot, chat_id, [file_ids.get(url, url) for url in image_urls], caption)
+    except TelegramBadRequest:
+        if not file_ids:
+            raise
+        # A cached file_id was refused: drop them and upload from the URLs once
+        await forget_file_ids(db, bot, list(file_ids))
+        file_ids = {}
+        messages = await send_album(bot, chat_id, image_urls, caption)
+
+    await save_file_ids(db, bot, [
+        (url, photo_file_id(msg)) for url, msg in zip(image_urls, messages)
+        if url not in file_ids and photo_file_id(msg)
+    ])
+    return [m.message_id for m in messages]
+
+
+async def delete_messages(bot: Bot, chat_id: str, message_ids: list[int]):
+    """Delete messages of one chat with deleteMessages, DELETE_BATCH_SIZE ids per call.
+
+    A batch Telegram rejects is retried one message at a time, so one bad id
+    doesn't keep the rest of its batch in the channel.
+    """
+    for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        batch = message_ids[start:start + DELETE_BATCH_SIZE]
         try:
-            await bot.delete_message(chat_id=CHANNEL_ID, message_id=msg_id)
-            print(f"🗑️ Deleted message {msg_id}")
-            bot_logger.info(f"Deleted message {msg_id} for product {product_id}")
-        except TelegramBadRequest:
-            print(f"⚠️ Message {msg_id} could not be deleted (already removed).")
-            error_logger.warning(f"Failed to delete message {msg_id} for product {product_id}")
+            if await scheduler_for(bot).call(chat_id, 0, lambda: bot.delete_messages(chat_id=chat_id, message_ids=batch)):
+                bot_logger.info(f"🗑️ Deleted messages {batch}", extra=fields(operation="delete", count=len(batch)))
+                continue
+        except TelegramBadRequest as e:
+            error_logger.warning(f"Bulk delete of {len(batch)} messages rejected: {e}. Deleting one by one.")
 
+        for msg_id in batch:
+            try:
+                await scheduler_for(bot).call(chat_id, 0, lambda: bot.delete_message(chat_id=chat_id, message_id=msg_id))
+                bot_logger.info(f"Deleted message {msg_id}")
+            except TelegramBadRequest:
+                error_logger.warning(f"⚠️ Message {msg_id} could not be deleted (already removed).",
+                                     extra=fields(operation="delete"))
 
-    await db.execute("DELETE FROM product_messages WHERE product_id = ?", (product_id,))
+
+async def delete_posts(db: aiosqlite.Connection, router: Router, product_ids: list[int]):
+    """Remove the posts of all given products, in whatever channel they are, and their product_messages rows."""
+    product_ids = json.dumps(product_ids)
+    async with db.execute(
+        "SELECT chat_id, message_id FROM product_messages WHERE product_id IN (SELECT value FROM json_each(?))",
+        (product_ids,)
+    ) as cur:
+        by_chat = {}
+        for chat_id, msg_id in await cur.fetchall():
+            by_chat.setdefault(chat_id, []).append(msg_id)
+
+    for chat_id, message_ids in by_chat.items():
+        await delete_messages(router.for_chat(chat_id).bot, chat_id, message_ids)
+
+    await db.execute(
+        "DELETE FROM product_messages WHERE product_id IN (SELECT value FROM json_each(?))", (product_ids,)
+    )
     await db.commit()
 
-async def delete_out_of_stock(bot: Bot, db: aiosqlite.Connection, product_id: int):
-    """ Deletes Telegram messages when stock is gone """
-    print(f"🚫 Product {product_id} is OUT OF STOCK — removing posts...")
-    bot_logger.info(f"Product {product_id} OUT OF STOCK — deleting messages")
 
-    await delete_previous_messages(db, bot, product_id)
+async def delete_previous_messages(db: aiosqlite.Connection, router: Router, product_id: int):
+    await delete_posts(db, router, [product_id])
 
-    # Optional: hide it from further processing
-    # await db.execute("UPDATE products SET needs_update = 0 WHERE id = ?", (product_id,))
-    # await db.commit()
 
+async def delete_out_of_stock(router: Router, db: aiosqlite.Connection, product_ids: list[int]):
+    """ Deletes Telegram messages when stock is gone, for a whole watcher pass at once """
+    started = time.perf_counter()
+    await delete_posts(db, router, product_ids)
+    bot_logger.info(f"🚫 Products {product_ids} OUT OF STOCK — posts removed",
+                    extra=fields(operation="remove", started=started, count=len(product_ids)))
 
-async def save_message_ids(db: aiosqlite.Connection, product_id: int, message_ids: list[int]):
+
+async def save_message_ids(db: aiosqlite.Connection, product_id: int, chat_id: str, message_ids: list[int],
+                           image_urls: list[str]):
+    # Album messages come back in image order; a text post has no image
     await db.executemany(
-        "INSERT INTO product_messages (product_id, message_id) VALUES (?, ?)",
-        [(product_id, mid) for mid in message_ids]
+        "INSERT INTO product_messages (product_id, message_id, image_url, chat_id) VALUES (?, ?, ?, ?)",
+        [(product_id, mid, url, chat_id) for mid, url in zip(message_ids, image_urls or [None])]
     )
     await db.commit()
 
 
+async def get_posted_messages(db: aiosqlite.Connection, product_id: int, chat_id: str):
+    """Return [(message_id, image_url), ...] of the current post in chat_id, in album order."""
+    async with db.execute(
+        "SELECT message_id, image_url FROM product_messages WHERE product_id = ? AND chat_id = ? ORDER BY message_id",
+        (product_id, chat_id)
+    ) as cursor:
+        return await cursor.fetchall()
+
+
+async def edit_message(bot: Bot, chat_id: str, make_call):
+    """Run an edit through the scheduler; an edit that changes nothing is not an error."""
+    try:
+        return await scheduler_for(bot).call(chat_id, 0, make_call)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+
+
+def fingerprint(caption: str, image_urls: list[str]):
+    """Return (caption_hash, media_hash) for a rendered post."""
+    caption_hash = hashlib.sha1(caption.encode("utf-8")).hexdigest()
+    media_hash = hashlib.sha1("\n".join(image_urls).encode("utf-8")).hexdigest()
+    return caption_hash, media_hash
+
+
+async def get_fingerprint(db: aiosqlite.Connection, product_id: int):
+    """Return the (caption_hash, media_hash) stored when the product was last posted."""
+    async with db.execute(
+        "SELECT caption_hash, media_hash FROM products WHERE id = ?", (product_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    return tuple(row) if row else (None, None)
+
+
+async def edit_product(bot: Bot, db: aiosqlite.Connection, chat_id: str, product_id: int,
+                       posted: list[tuple[int, str]], image_urls: list[str], caption: str,
+                       caption_changed: bool = True, media_changed: bool = True):
+    """Update a post in place: new photos only where the URL changed, then the caption.
+
+    Returns False if Telegram rejected an edit and the product has to be reposted.
+    """
+    try:
+        if not image_urls:
+            ((message_id, _),) = posted
+            await edit_message(bot, chat_id, lambda: bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id, text=caption, parse_mode="HTML"
+            ))
+        else:
+            replaced = []
+            uploaded = []
+            changed_urls = [new for (_, old), new in zip(posted, image_urls) if old != new]
+            file_ids = await get_file_ids(db, bot, changed_urls) if media_changed and changed_urls else {}
+            for position, ((message_id, old_url), new_url) in enumerate(zip(posted, image_urls)):
+                if not media_changed or old_url == new_url:
+                    continue
+                # The caption lives on the first album item and is replaced with its media
+                media = types.InputMediaPhoto(
+                    media=file_ids.get(new_url, new_url), caption=caption if position == 0 else None,
+                    parse_mode="HTML"
+                )
+                edited = await edit_message(bot, chat_id, lambda: bot.edit_message_media(
+                    chat_id=chat_id, message_id=message_id, media=media
+                ))
+                replaced.append((new_url, product_id, message_id))
+                if new_url not in file_ids and photo_file_id(edited):
+                    uploaded.append((new_url, photo_file_id(edited)))
+            await save_file_ids(db, bot, uploaded)
+
+            first_message_id, first_url = posted[0]
+            if caption_changed and (not media_changed or first_url == image_urls[0]):
+                await edit_message(bot, chat_id, lambda: bot.edit_message_caption(
+                    chat_id=chat_id, message_id=first_message_id, caption=caption, parse_mode="HTML"
+                ))
+
+            await db.executemany(
+                "UPDATE product_messages SET image_url = ? WHERE product_id = ? AND message_id = ?",
+                replaced
+            )
+            await db.commit()
+    except TelegramBadRequest as e:
+        error_logger.warning(f"⚠️ Edit rejected for product {product_id}: {e}. Reposting.",
+                             extra=fields(product_id, "edit"))
+        return False
+    return True
+
+
 # async def get_products_to_update(db: aiosqlite.Connection):
 #     async with db.execute("SELECT id FROM products WHERE visible = 1 AND needs_update = 1") as cursor:
 #         rows = await cursor.fetchall()
 #         return [r[0] for r in rows]
 
-async def get_products_to_update(db: aiosqlite.Connection):
-    async with db.execute("""
-        SELECT DISTINCT product_id
-        FROM product_messages
-    """) as cursor:
-        rows = await cursor.fetchall()
+# Both halves are driven by the partial indexes from database.CREATE_INDEXES and
+# probe product_messages by index, so a pass costs O(changed), not O(catalog).
+# Only used on the first start, to pick up flags raised before the change log existed.
+PENDING_PRODUCTS_SQL = """
+    SELECT p.id, 0 AS out_of_stock
+    FROM products p
+    WHERE p.needs_update = 1
+      AND p.visible = 1
+      AND IFNULL(p.stock, 0) <> 0
+      AND EXISTS (SELECT 1 FROM product_messages m WHERE m.product_id = p.id)
+    UNION ALL
+    SELECT p.id, 1 AS out_of_stock
+    FROM products p
+    WHERE IFNULL(p.stock, 0) = 0
+      AND p.visible = 1
+      AND EXISTS (SELECT 1 FROM product_messages m WHERE m.product_id = p.id)
+"""
+
+
+# Collapses a window of the change log into one row per product that is posted
+# or could be. Removal is decided from the current row state; for a posted
+# product a pure stock movement is not repost-worthy, while a product without a
+# post (new, restocked, unhidden) is posted as soon as it is visible and in stock.
+# A posted product that is back in stock before its delete job ran gets a publish
+# job in its place (enqueue_jobs replaces the kind), so the post is kept.
+# The most urgent change kind sets the job priority (see job_queue.PRIORITY_*);
+# stock movements and deletions don't count, as they never publish by themselves.
+# A first post, or one kept by a restock alone, is content priority, as in reconcile.py.
+CHANGED_PRODUCTS_SQL = """
+    SELECT product_id, remove, NOT posted OR changed OR deleting, CASE WHEN posted THEN IFNULL(priority, 2) ELSE 2 END
+    FROM (
+        SELECT c.product_id,
+               p.id IS NULL OR p.visible IS NOT 1 OR IFNULL(p.stock, 0) = 0 AS remove,
+               MAX(c.kind NOT IN ('stock', 'delete')) AS changed,
+               MIN(CASE WHEN c.kind IN ('stock', 'delete') THEN NULL
+                        WHEN c.kind = 'price' THEN 1 WHEN c.kind = 'manual' THEN 3 ELSE 2 END) AS priority,
+               EXISTS (SELECT 1 FROM product_messages m WHERE m.product_id = c.product_id) AS posted,
+               EXISTS (
+                   SELECT 1 FROM publish_jobs j WHERE j.product_id = c.product_id AND j.kind = 'delete'
+               ) AS deleting
+        FROM product_changes c
+        LEFT JOIN products p ON p.id = c.product_id
+        WHERE c.id > ? AND c.id <= ?
+        GROUP BY c.product_id
+    )
+    WHERE posted OR NOT remove
+"""
+
 
+async def get_pending_products(db: aiosqlite.Connection):
     update_list = []
     delete_list = []
 
-    for (product_id,) in rows:
-        async with db.execute("""
-            SELECT stock, needs_update
-            FROM products
-            WHERE id = ? AND visible = 1
-        """, (product_id,)) as cur:
-            result = await cur.fetchone()
+    async with db.execute(PENDING_PRODUCTS_SQL) as cursor:
+        async for product_id, out_of_stock in cursor:
+            if out_of_stock:
+                delete_list.append(product_id)
+            else:
+                update_list.append((product_id, PRIORITY_COSMETIC))
+
+    return update_list, delete_list
 
-        if not result:
-            continue
 
-        stock, needs_update = result
+async def get_high_water_mark(db: aiosqlite.Connection):
+    """Return the id of the last consumed change, or None if the watcher never ran on this DB."""
+    async with db.execute(
+        "SELECT value FROM watcher_state WHERE key = ?", (HIGH_WATER_MARK_KEY,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def save_high_water_mark(db: aiosqlite.Connection, change_id: int):
+    """Persist the high-water mark and prune the change log up to it."""
+    await db.execute(
+        """
+        INSERT INTO watcher_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """,
+        (HIGH_WATER_MARK_KEY, change_id)
+    )
+    await db.execute("DELETE FROM product_changes WHERE id <= ?", (change_id,))
+    await db.commit()
 
-        if stock is None or stock == 0:
-            delete_list.append(product_id)
-        elif needs_update == 1:
-            update_list.append(product_id)
 
-    return update_list, delete_list
+async def get_products_to_update(db: aiosqlite.Connection, since: int):
+    """Read the next batch of changes after `since`.
 
+    Returns (update_list, delete_list, last_change_id); update_list holds
+    (product_id, priority) pairs. Pass last_change_id to save_high_water_mark
+    once the lists have been processed.
+    """
+    async with db.execute(
+        "SELECT MAX(id) FROM (SELECT id FROM product_changes WHERE id > ? ORDER BY id LIMIT ?)",
+        (since, CHANGE_BATCH_SIZE)
+    ) as cursor:
+        (last_change_id,) = await cursor.fetchone()
 
+    if last_change_id is None:
+        return [], [], since
 
-async def mark_product_sent(db: aiosqlite.Connection, product_id: int):
-    await db.execute("UPDATE products SET needs_update = 0 WHERE id = ?", (product_id,))
+    update_list = []
+    delete_list = []
+
+    async with db.execute(CHANGED_PRODUCTS_SQL, (since, last_change_id)) as cursor:
+        async for product_id, remove, changed, priority in cursor:
+            if remove:
+                delete_list.append(product_id)
+            elif changed:
+                update_list.append((product_id, priority))
+
+    return update_list, delete_list, last_change_id
+
+
+async def mark_product_sent(db: aiosqlite.Connection, product_id: int, caption_hash: str, media_hash: str):
+    await db.execute(
+        "UPDATE products SET needs_update = 0, caption_hash = ?, media_hash = ? WHERE id = ?",
+        (caption_hash, media_hash, product_id)
+    )
     await db.commit()
 
 
-async def send_product(bot: Bot, db: aiosqlite.Connection, product_id: int):
+async def send_product(router: Router, db: aiosqlite.Connection, product_id: int):
+    """Publish a product to the channel of its category, editing its post in
+    place when the album size is unchanged.
+
+    A post in another channel (the category moved) is deleted and the product
+    posted anew. Telegram errors are raised; the job queue retries the product later.
+    """
+    started = time.perf_counter()
     async with db.execute(
-        "SELECT name, description, url FROM products WHERE id = ? AND visible = 1",
+        "SELECT name, description, url, category FROM products WHERE id = ? AND visible = 1",
         (product_id,)
     ) as cursor:
         product = await cursor.fetchone()
         if not product:
             return
-    name, description, url = product
-    description = clean_html(description)
+    name, description, url, category = product
+    channel = router.for_category(category)
+    bot, chat_id = channel.bot, channel.chat_id
+    # Usually pre-rendered by the importer, see captions.py
+    caption = await get_caption(db, name, description, url)
 
     async with db.execute(
-        "SELECT image_url FROM product_images WHERE product_id = ?", (product_id,)
+        "SELECT image_url FROM product_images WHERE product_id = ? ORDER BY id", (product_id,)
     ) as cursor:
         images = await cursor.fetchall()
         image_urls = [img[0] for img in images if img[0]]
+    # A dead or non-image URL would fail the whole album: post without it
+    image_urls = await usable_images(db, image_checker, product_id, image_urls)
+
+    posted = await get_posted_messages(db, product_id, chat_id)
+
+    caption_hash, media_hash = fingerprint(caption, image_urls)
+    posted_caption_hash, posted_media_hash = await get_fingerprint(db, product_id)
+    DB_SECONDS.observe(time.perf_counter() - started, query="send_product")
+    caption_changed = caption_hash != posted_caption_hash
+    media_changed = media_hash != posted_media_hash
+
+    if posted and not caption_changed and not media_changed:
+        # Nothing visible changed since the last post: no Telegram calls at all
+        await mark_product_sent(db, product_id, caption_hash, media_hash)
+        PUBLISH_SECONDS.observe(time.perf_counter() - started, outcome="skip")
+        bot_logger.info(f"Product {product_id} unchanged, skipped.", extra=fields(product_id, "skip", started))
+        return
+
+    # Pacing and flood-control retries are handled by the scheduler.
+    # Same number of messages: edit in place, message ids stay the same
+    if posted and len(posted) == max(len(image_urls), 1):
+        if await edit_product(bot, db, chat_id, product_id, posted, image_urls, caption,
+                              caption_changed, media_changed):
+            await mark_product_sent(db, product_id, caption_hash, media_hash)
+            changed = ", ".join(
+                part for part, flag in (("caption", caption_changed), ("media", media_changed)) if flag
+            )
+            PUBLISH_SECONDS.observe(time.perf_counter() - started, outcome="edit")
+            IMAGES_PER_POST.observe(len(image_urls))
+            bot_logger.info(f"✏️ Product {product_id} edited in place ({changed}).",
+                            extra=fields(product_id, "edit", started))
+            return
+
+    await delete_previous_messages(db, router, product_id)
+    if image_urls:
+        message_ids = await send_images(bot, db, chat_id, image_urls, caption)
+    else:
+        msg = await scheduler_for(bot).call(chat_id, 1, lambda: bot.send_message(
+            chat_id=chat_id, text=caption, parse_mode="HTML"
+        ))
+        message_ids = [msg.message_id]
+
+    await save_message_ids(db, product_id, chat_id, message_ids, image_urls)
+    await mark_product_sent(db, product_id, caption_hash, media_hash)
+    PUBLISH_SECONDS.observe(time.perf_counter() - started, outcome="post")
+    IMAGES_PER_POST.observe(len(image_urls))
+    bot_logger.info(f"✅ Product {product_id} posted to {channel.name}.",
+                    extra=fields(product_id, "post", started, count=len(message_ids), chat_id=chat_id))
+
+
+async def enqueue_products(db: aiosqlite.Connection, update_list: list[tuple[int, int]], delete_list: list[int]):
+    """Turn a watcher pass into jobs. Not committed: save_high_water_mark commits
+    the jobs together with the new mark, so a crash can't lose or double them."""
+    await enqueue_jobs(db, "delete", delete_list)
+    await enqueue_prioritized(db, "publish", update_list)
+
+
+async def consume_changes(db: aiosqlite.Connection) -> bool:
+    """Turn the next batch of the change log into jobs. Returns True if there was one.
+
+    The high-water mark is read under the write lock, so when several watcher
+    processes share the DB each batch is consumed by exactly one of them.
+    """
+    await begin_immediate(db)
+    since = await get_high_water_mark(db)
+    if since is None:
+        # First start on this DB: flags raised before the change log existed
+        async with db.execute("SELECT IFNULL(MAX(id), 0) FROM product_changes") as cursor:
+            (since,) = await cursor.fetchone()
+        update_list, delete_list = await get_pending_products(db)
+        await enqueue_products(db, update_list, delete_list)
+        await save_high_water_mark(db, since)
+        return True
+
+    update_list, delete_list, last_change_id = await get_products_to_update(db, since)
+    if last_change_id == since:
+        await db.commit()
+        return False
+    await enqueue_products(db, update_list, delete_list)
+    await save_high_water_mark(db, last_change_id)
+    return True
+
+
+async def report_job_failure(db: aiosqlite.Connection, job: Job, e: Exception):
+    error = f"{type(e).__name__}: {e}"
+    if await fail_job(db, job, error):
+        error_logger.warning(
+            f"⚠️ {job.kind} failed for product {job.product_id} (attempt {job.attempts}), will retry: {error}",
+            extra=fields(job.product_id, job.kind, attempt=job.attempts)
+        )
+    else:
+        error_logger.error(
+            f"❌ {job.kind} for product {job.product_id} moved to dead_jobs after {job.attempts} attempts: {error}",
+            extra=fields(job.product_id, job.kind, attempt=job.attempts)
+        )
 
-    await delete_previous_messages(db, bot, product_id)
 
-    caption = f"🛒 <b>{name}</b>\n\n{description}\n\n🔗 More info: {url}"
-    message_ids = []
+async def run_due_jobs(router: Router, db: aiosqlite.Connection, owner: str = None):
+    """Run the jobs that are due, leased to `owner`: all removals in bulk, then up
+    to JOBS_PER_PASS publishes per channel, most urgent first (see job_queue.CLAIM_SQL)."""
+    processed = 0
 
-    for attempt in range(1, MAX_RETRIES + 1):
+    # ⭐ Delete products that are OUT OF STOCK
+    while jobs := await claim_jobs(db, "delete", DELETE_BATCH_SIZE, owner=owner):
         try:
-            if image_urls:
-                message_ids = await send_images(bot, CHANNEL_ID, image_urls, caption)
-            else:
-                msg = await bot.send_message(chat_id=CHANNEL_ID, text=caption, parse_mode="HTML")
-                message_ids = [msg.message_id]
-            break  # success
-        except TelegramRetryAfter as e:
-            wait = getattr(e, "retry_after", 5)
-            backoff = wait * attempt
-            print(f"⚠️ Flood control hit for product {product_id}. Retry {attempt}/{MAX_RETRIES} after {backoff}s.")
-            error_logger(f"⚠️ Flood control hit for product {product_id}. Retry {attempt}/{MAX_RETRIES} after {backoff}s.")
-            await asyncio.sleep(backoff)
+            await delete_out_of_stock(router, db, [job.product_id for job in jobs])
         except Exception as e:
-            print(f"⚠️ Unexpected error sending product {product_id}: {e}")
-            error_logger(f"⚠️ Unexpected error sending product {product_id}: {e}")
-            return  # skip this product
-
-    if message_ids:
-        await save_message_ids(db, product_id, message_ids)
-        await mark_product_sent(db, product_id)
-        print(f"✅ Product {product_id} posted.")
-        bot_logger.info(f"Product {product_id} posted.")
-
-    await asyncio.sleep(DELAY_BETWEEN_PRODUCTS)
+            for job in jobs:
+                await report_job_failure(db, job, e)
+        else:
+            for job in jobs:
+                await complete_job(db, job)
+        processed += len(jobs)
+
+    # Process normal updates: per channel, CONCURRENT_LIMIT workers each leasing
+    # a few of its jobs at a time, so channels don't wait on each other's rate budget
+    published = dict.fromkeys(router.channels, 0)
+
+    async def worker(channel: Channel):
+        while published[channel.name] < JOBS_PER_PASS:
+            limit = min(CLAIM_BATCH_SIZE, JOBS_PER_PASS - published[channel.name])
+            jobs = await claim_jobs(db, "publish", limit, channel.name, router.routes, router.default, owner)
+            if not jobs:
+                return
+            published[channel.name] += len(jobs)
+            for job in jobs:
+                try:
+                    await send_product(router, db, job.product_id)
+                except Exception as e:
+                    await report_job_failure(db, job, e)
+                else:
+                    await complete_job(db, job)
+
+    await asyncio.gather(*(
+        worker(channel) for channel in router.channels.values() for _ in range(CONCURRENT_LIMIT)
+    ))
+    published = sum(published.values())
+    processed += published
+
+    depth = await queue_depth(db)
+    BACKLOG.replace([
+        ({"kind": kind, "priority": PRIORITY_NAMES.get(priority, priority), "state": state}, jobs)
+        for kind, priority, state, jobs, _ in depth
+    ])
+    if processed:
+        bot_logger.info(f"Queue after pass: {format_queue_depth(depth)}")
+    if published:
+        bot_logger.info(
+            f"file_id cache: {file_id_stats['hits']} hits, {file_id_stats['misses']} misses since start"
+        )
+    elif not processed:
+        bot_logger.info("⏱️ No updates found.", extra={"sample": "idle"})
+    return processed
+
+
+async def adopt_unrouted_messages(db: aiosqlite.Connection, router: Router):
+    """Posts saved before routing existed are in the default channel."""
+    await db.execute(
+        "UPDATE product_messages SET chat_id = ? WHERE chat_id IS NULL", (router.default_channel.chat_id,)
+    )
+    await db.commit()
 
 
-async def watch_products(bot: Bot):
-    semaphore = asyncio.Semaphore(CONCURRENT_LIMIT)
-    async with aiosqlite.connect(DB_NAME) as db:
-        while True:
-            try:
-                update_list, delete_list = await get_products_to_update(db)
-                # ⭐ Delete products that are OUT OF STOCK
-                for pid in delete_list:
-                    await delete_out_of_stock(bot, db, pid)
-
-                # Process normal updates
-                if update_list:
-                    async def sem_task(pid):
-                        async with semaphore:
-                            await send_product(bot, db, pid)
-                    await asyncio.gather(*(sem_task(pid) for pid in update_list))
-                else:
-                    print("⏱️ No updates found.")
+async def keep_leases(db: aiosqlite.Connection, owner: str):
+    """Heartbeat of one watcher run, on its own connection so a long publish
+    pass never delays it: renews the run's job leases, splits each bot's
+    rate budget evenly between the watchers alive on this DB and ages the
+    waiting jobs (see job_queue.age_jobs)."""
+    watchers = 1
+    while True:
+        try:
+            alive = await heartbeat(db, owner)
+            await age_jobs(db)
+            if alive != watchers:
+                bot_logger.info(f"{alive} watcher(s) share this DB; rate budgets split accordingly")
+                watchers = alive
+            for scheduler in schedulers.values():
+                scheduler.set_share(1 / alive)
+        except Exception as e:
+            error_logger.warning(f"⚠️ Lease renewal failed: {e}")
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+
+
+async def watch_products(router: Router):
+    db = await connections.writer()
+    await adopt_unrouted_messages(db, router)
+    # The routes file may have changed since the jobs were routed
+    await forget_routes(db)
+
+    # Other watcher processes may share the DB: jobs are leased to this run's
+    # owner id and renewed by keep_leases; if this process dies, they expire
+    # and another watcher picks them up.
+    owner = new_owner()
+    async with connect(connections.db_name) as lease_db:
+        await heartbeat(lease_db, owner)
+        for bot in {channel.bot.id: channel.bot for channel in router.channels.values()}.values():
+            scheduler_for(bot)
+        lease_keeper = asyncio.create_task(keep_leases(lease_db, owner))
+
+        # The importer and mark_updater wake us right after committing; polling is the fallback
+        waker = Waker(min_poll=MIN_POLL_INTERVAL, max_poll=MAX_POLL_INTERVAL)
+        await waker.start()
+        try:
+            while True:
+                busy = False
+                pass_started = time.perf_counter()
+                try:
+                    with DB_SECONDS.time(query="get_products_to_update"):
+                        busy |= await consume_changes(db)
+                    # New products, hidden ones and drift the change log can't see
+                    with DB_SECONDS.time(query="reconcile_step"):
+                        busy |= await reconcile_step(db)
+                    # Includes jobs left running by a dead watcher once their lease expires;
+                    # meanwhile the images of queued products are validated ahead of their turn
+                    processed, _ = await asyncio.gather(
+                        run_due_jobs(router, db, owner), prefetch_images(db, image_checker)
+                    )
+                    busy |= processed > 0
 
-            except Exception as e:
-                print(f"⚠️ Error in watcher loop: {e}")
-                error_logger(f"⚠️ Error in watcher loop: {e}")
-            await asyncio.sleep(CHECK_INTERVAL)
+                except Exception as e:
+                    if db.in_transaction:
+                        await db.rollback()
+                    error_logger.exception(f"⚠️ Error in watcher loop: {e}")
+                PASS_SECONDS.observe(time.perf_counter() - pass_started)
+                await waker.wait(busy, await seconds_until_next_job(db))
+        finally:
+            waker.close()
+            await image_checker.close()
+            lease_keeper.cancel()
+            await release_jobs(lease_db, owner)
 
 if __name__ == "__main__":
 
-    bot = Bot(token=BOT_TOKEN)
+    router = load_router()
     async def main():
-    # ensures session closes even after crash / KeyboardInterrupt
-        async with bot:
+    # ensures sessions close even after crash / KeyboardInterrupt
+        try:
+            stop_metrics = await start_metrics()
             while True:
                 try:
-                    bot_logger.info("Starting watcher loop...")
-                    await watch_products(bot)
+                    bot_logger.info(f"Starting watcher loop for channels: {', '.join(router.channels)}")
+                    await watch_products(router)
                 except KeyboardInterrupt:
                     bot_logger.info("Bot stopped manually.")
                     break
                 except Exception as e:
                     error_logger.exception(f"Bot crashed: {e}. Restarting in 10s...")
+                    await connections.close()  # reopened on restart
                     await asyncio.sleep(10)
                 else:
                     bot_logger.warning("Watcher exited unexpectedly. Restarting in 5s...")
                     await asyncio.sleep(5)
+            await stop_metrics()
+        finally:
+            await router.close()
+            await connections.close()
 
     asyncio.run(main())
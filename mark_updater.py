@@ -1,22 +1,114 @@
 # mark_updated.py
-import sqlite3
+import argparse
+import json
+import sys
+import time
+
 from config import DB_NAME
+from database import connect_sync
+from notify import notify_watcher
+
+
+def mark_products(ids: list[int] = None, articles: list[str] = None, category: str = None,
+                  min_price: float = None, max_price: float = None,
+                  min_stock: int = None, max_stock: int = None,
+                  all_products: bool = False, db_name: str = DB_NAME) -> int:
+    """Flag every product matching all the given selectors with one UPDATE.
+
+    Returns how many products were newly flagged (already flagged ones are
+    left alone, so the change log doesn't get duplicate entries).
+    """
+    conditions = []
+    params = []
+    if ids is not None:
+        conditions.append("id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(ids))
+    if articles is not None:
+        conditions.append("article IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(articles))
+    for clause, value in (
+        ("category = ?", category),
+        ("price >= ?", min_price),
+        ("price <= ?", max_price),
+        ("IFNULL(stock, 0) >= ?", min_stock),
+        ("IFNULL(stock, 0) <= ?", max_stock),
+    ):
+        if value is not None:
+            conditions.append(clause)
+            params.append(value)
+
+    if not conditions and not all_products:
+        raise ValueError("No selector given; pass all_products=True to flag the whole catalog.")
+
+    conn = connect_sync(db_name)
+    try:
+        with conn:  # one transaction
+            cursor = conn.execute(
+                "UPDATE products SET needs_update = 1 WHERE needs_update IS NOT 1"
+                + "".join(f" AND {condition}" for condition in conditions),
+                params
+            )
+        marked = cursor.rowcount
+    finally:
+        conn.close()
+
+    if marked:
+        notify_watcher()
+    return marked
+
 
 def mark_product_updated(product_id: int):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    mark_products(ids=[product_id])
+    print(f"✅ Marked product {product_id} as needing update.")
 
-    cursor.execute(
-        "UPDATE products SET needs_update = 1 WHERE id = ?",
-        (product_id,)
+
+def read_articles(source: str) -> list[str]:
+    """Whitespace-separated articles from a file, or from stdin for '-'."""
+    if source == "-":
+        return sys.stdin.read().split()
+    with open(source, encoding="utf-8") as f:
+        return f.read().split()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Flag products for republishing. All given selectors must match."
     )
-    conn.commit()
-    conn.close()
-    print(f"✅ Marked product {product_id} as needing update.")
+    parser.add_argument("ids", nargs="*", type=int, help="product ids")
+    parser.add_argument("--articles", metavar="FILE", help="file with articles, '-' for stdin")
+    parser.add_argument("--category", help="exact 'Размещение на сайте' value")
+    parser.add_argument("--min-price", type=float)
+    parser.add_argument("--max-price", type=float)
+    parser.add_argument("--min-stock", type=int)
+    parser.add_argument("--max-stock", type=int)
+    parser.add_argument("--all", action="store_true", help="flag the whole catalog")
+    args = parser.parse_args()
 
-if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        # No arguments: the original interactive prompt
+        try:
+            product_id = int(input("Enter product ID to mark for update: "))
+            mark_product_updated(product_id)
+        except ValueError:
+            print("❌ Invalid input. Please enter a valid product ID (integer).")
+        return
+
+    started = time.perf_counter()
     try:
-        product_id = int(input("Enter product ID to mark for update: "))
-        mark_product_updated(product_id)
-    except ValueError:
-        print("❌ Invalid input. Please enter a valid product ID (integer).")
\ No newline at end of file
+        marked = mark_products(
+            ids=args.ids or None,
+            articles=read_articles(args.articles) if args.articles else None,
+            category=args.category,
+            min_price=args.min_price,
+            max_price=args.max_price,
+            min_stock=args.min_stock,
+            max_stock=args.max_stock,
+            all_products=args.all,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"✅ Marked {marked} products as needing update in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+
+if __name__ == "__main__":
+    main()
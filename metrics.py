@@ -0,0 +1,196 @@
+# metrics.py
+import asyncio
+import bisect
+import logging
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+from config import METRICS_DUMP_INTERVAL, METRICS_HOST, METRICS_PORT
+
+bot_logger = logging.getLogger("bot")
+error_logger = logging.getLogger("errors")
+
+# Seconds; Bot API calls sit around 0.1-1 s, DB queries well below that
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(labels)] = value
+
+    def replace(self, series: list[tuple[dict, float]]):
+        """Set all series at once from (labels, value) pairs, dropping the rest."""
+        self.values = {_label_key(labels): value for labels, value in series}
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.values.get(key)
+        if series is None:
+            # [per-bucket counts (last one is +Inf), sum, count]
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def summary(self, **labels):
+        """(count, mean, approximate p95) of one series, None if nothing was observed."""
+        series = self.values.get(_label_key(labels))
+        if not series or not series[2]:
+            return None
+        counts, total, count = series
+        rank, seen = 0.95 * count, 0
+        for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+            seen += bucket
+            if seen >= rank:
+                return count, total / count, bound
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+REGISTRY: list[Metric] = []
+
+TELEGRAM_SECONDS = Histogram("tgbot_telegram_request_seconds", "Bot API call latency by method")
+TELEGRAM_ERRORS = Counter("tgbot_telegram_errors_total", "Bot API calls that raised, by method and error")
+SCHEDULER_WAIT_SECONDS = Histogram("tgbot_scheduler_wait_seconds", "Time a call waited for its rate budget")
+FLOOD_CONTROL = Counter("tgbot_flood_control_total", "retry_after answers from Telegram, by method")
+FLOOD_CONTROL_SECONDS = Counter("tgbot_flood_control_seconds_total", "Seconds of retry_after pauses imposed")
+DB_SECONDS = Histogram("tgbot_db_query_seconds", "Watcher DB work by query")
+PASS_SECONDS = Histogram("tgbot_watcher_pass_seconds", "Duration of one watch_products pass")
+PUBLISH_SECONDS = Histogram("tgbot_publish_seconds", "send_product duration by outcome")
+IMAGES_PER_POST = Histogram("tgbot_images_per_post", "Images in each published product", COUNT_BUCKETS)
+IMAGE_CHECKS = Counter("tgbot_image_checks_total", "Image URLs probed, by result (ok / bad)")
+IMAGE_CHECK_SECONDS = Histogram("tgbot_image_check_seconds", "Time to probe one image URL")
+IMAGES_EXCLUDED = Counter("tgbot_images_excluded_total", "Images left out of a post because they failed the check")
+BACKLOG = Gauge("tgbot_backlog_jobs", "Jobs in publish_jobs by kind, priority and state")
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+def summary() -> str:
+    """One-line digest for bot.log: per-method latency, flood waits, pass time, backlog."""
+    parts = []
+    for key in sorted(TELEGRAM_SECONDS.values):
+        count, mean, p95 = TELEGRAM_SECONDS.summary(**dict(key))
+        parts.append(f"{dict(key)['method']} n={count} avg={mean * 1000:.0f}ms p95<={p95}s")
+    flood = sum(FLOOD_CONTROL.values.values())
+    if flood:
+        parts.append(f"flood control {flood:.0f}x / {sum(FLOOD_CONTROL_SECONDS.values.values()):.0f}s")
+    passes = PASS_SECONDS.summary()
+    if passes:
+        parts.append(f"passes n={passes[0]} avg={passes[1] * 1000:.0f}ms")
+    parts.append(f"backlog {sum(BACKLOG.values.values()):.0f}")
+    return "; ".join(parts)
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def _dump_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        bot_logger.info(f"📈 Metrics: {summary()}")
+
+
+async def start_metrics(host: str = METRICS_HOST, port: int = METRICS_PORT,
+                        dump_interval: float = METRICS_DUMP_INTERVAL):
+    """Serve /metrics on host:port (port 0: don't) and log a summary every
+    dump_interval seconds (0: don't). Returns a coroutine function that stops both.
+    """
+    runner = None
+    dumper = None
+    if port:
+        app = web.Application()
+        app.router.add_get("/metrics", _handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, host, port).start()
+            bot_logger.info(f"Metrics on http://{host}:{port}/metrics")
+        except OSError as e:
+            error_logger.warning(f"Metrics endpoint {host}:{port} unavailable: {e}")
+            await runner.cleanup()
+            runner = None
+    if dump_interval:
+        dumper = asyncio.create_task(_dump_periodically(dump_interval))
+
+    async def stop():
+        if dumper is not None:
+            dumper.cancel()
+        if runner is not None:
+            await runner.cleanup()
+
+    return stop
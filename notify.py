@@ -0,0 +1,98 @@
+# notify.py
+import asyncio
+import glob
+import logging
+import os
+import socket
+
+from config import WAKE_SOCKET
+
+error_logger = logging.getLogger("errors")
+
+
+def notify_watcher(path: str = WAKE_SOCKET) -> bool:
+    """Tell the running watchers to look at the DB now. Call it after committing.
+
+    Every watcher process listens on `<path>.<pid>`. Returns False (and does
+    nothing else) when none is listening or the platform has no Unix sockets;
+    the watchers' fallback polling picks the change up then.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+    woken = False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        for address in glob.glob(glob.escape(path) + ".*"):
+            try:
+                sock.sendto(b"wake", address)
+                woken = True
+            except ConnectionRefusedError:
+                # Left behind by a watcher that died without cleaning up
+                try:
+                    os.unlink(address)
+                except OSError:
+                    pass
+            except OSError:
+                pass
+    return woken
+
+
+class _WakeProtocol(asyncio.DatagramProtocol):
+    def __init__(self, event: asyncio.Event):
+        self.event = event
+
+    def datagram_received(self, data, addr):
+        self.event.set()
+
+
+class Waker:
+    """Sleeps between watcher passes until notified, with adaptive polling as fallback.
+
+    Every idle pass doubles the poll interval up to max_poll; a pass that did
+    work or a notification brings it back to min_poll.
+    """
+
+    def __init__(self, path: str = WAKE_SOCKET, min_poll: float = 1.0, max_poll: float = 30.0):
+        self.path = f"{path}.{os.getpid()}"  # one socket per watcher process
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.interval = min_poll
+        self.event = asyncio.Event()
+        self.transport = None
+
+    async def start(self):
+        if not hasattr(socket, "AF_UNIX"):
+            return
+        try:
+            if os.path.exists(self.path):
+                os.unlink(self.path)  # left over from a previous run
+            self.transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _WakeProtocol(self.event), local_addr=self.path, family=socket.AF_UNIX
+            )
+        except OSError as e:
+            error_logger.warning(f"Wake socket {self.path} unavailable ({e}), polling only")
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    async def wait(self, busy: bool, due_in: float = None) -> bool:
+        """Sleep until notified, the poll interval runs out or `due_in` seconds pass.
+
+        Returns True if woken by a notification.
+        """
+        self.interval = self.min_poll if busy else min(self.interval * 2, self.max_poll)
+        timeout = self.interval if due_in is None else max(0.0, min(self.interval, due_in))
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+            woke = True
+            self.interval = self.min_poll
+        except asyncio.TimeoutError:
+            woke = False
+        self.event.clear()
+        return woke
@@ -0,0 +1,142 @@
+# rate_limiter.py
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import FLOOD_CONTROL, FLOOD_CONTROL_SECONDS, SCHEDULER_WAIT_SECONDS, TELEGRAM_ERRORS, TELEGRAM_SECONDS
+
+# Telegram's documented limits: ~30 messages/s per bot overall and
+# 20 messages/min into one group or channel. A media group counts as one
+# message per item.
+GLOBAL_RATE = 30.0        # messages per second across all chats
+GLOBAL_BURST = 30         # bucket capacity
+CHAT_RATE = 20 / 60       # messages per second into one channel
+CHAT_BURST = 20           # bucket capacity, one minute worth of messages
+MAX_RETRIES = 3           # attempts per call when flood control answers
+
+error_logger = logging.getLogger("errors")
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` stored."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens: float) -> float:
+        """Seconds until `tokens` can be taken (0 if they are available now)."""
+        self._refill(time.monotonic())
+        # A request bigger than the bucket (a 10-photo album on a small bucket)
+        # is let through once the bucket is full instead of waiting forever.
+        needed = min(tokens, self.capacity) - self.tokens
+        return max(0.0, needed / self.rate)
+
+    def take(self, tokens: float):
+        self._refill(time.monotonic())
+        self.tokens -= tokens
+
+
+class SendScheduler:
+    """Paces every Bot API call through a global bucket and one bucket per chat.
+
+    Calls are admitted in FIFO order. When Telegram answers with retry_after,
+    the whole scheduler pauses, not just the task that got the error.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, global_burst: float = GLOBAL_BURST,
+                 chat_rate: float = CHAT_RATE, chat_burst: float = CHAT_BURST):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.share = 1.0
+        self.chat_buckets: dict[str, TokenBucket] = {}
+        self.chat_locks: dict[str, asyncio.Lock] = {}
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            bucket = self.chat_buckets[key] = TokenBucket(self.chat_rate * self.share, self.chat_burst * self.share)
+        return bucket
+
+    def set_share(self, share: float):
+        """Use only `share` of the limits, e.g. 1/3 when three watcher processes
+        post with the same bot. Stored tokens are capped to the new capacity."""
+        self.share = share
+        buckets = [(self.global_bucket, self.global_rate, self.global_burst)]
+        buckets += [(bucket, self.chat_rate, self.chat_burst) for bucket in self.chat_buckets.values()]
+        for bucket, rate, burst in buckets:
+            bucket.rate = rate * share
+            bucket.capacity = burst * share
+            bucket.tokens = min(bucket.tokens, bucket.capacity)
+
+    def pause(self, seconds: float):
+        """Hold back every caller for `seconds` (flood control)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id, messages: int):
+        """Wait until `messages` messages may be sent to `chat_id`.
+
+        messages=0 is used for calls that don't post anything (deletes, edits):
+        they only consume one token of the global budget.
+
+        Callers for one chat queue on that chat's lock while its bucket refills;
+        only the global bucket is waited for under the shared lock, so a full
+        chat never holds up sends to the others.
+        """
+        chat_bucket = self._chat_bucket(chat_id)
+        async with self.chat_locks.setdefault(str(chat_id), asyncio.Lock()):
+            while messages and (wait := chat_bucket.wait_time(messages)) > 0:
+                await asyncio.sleep(wait)
+            async with self._lock:
+                while True:
+                    wait = max(self.paused_until - time.monotonic(), self.global_bucket.wait_time(max(messages, 1)))
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                self.global_bucket.take(max(messages, 1))
+            chat_bucket.take(messages)
+
+    async def call(self, chat_id, messages: int, make_call):
+        """Run `make_call()` (a coroutine factory) within the rate budget.
+
+        Flood control is retried up to MAX_RETRIES times; the last
+        TelegramRetryAfter is re-raised. Latency is recorded per Bot API method
+        (the name of the coroutine make_call returns).
+        """
+        for attempt in range(1, MAX_RETRIES + 1):
+            with SCHEDULER_WAIT_SECONDS.time():
+                await self.acquire(chat_id, messages)
+            call = make_call()
+            method = getattr(call, "__name__", "unknown")
+            started = time.perf_counter()
+            try:
+                return await call
+            except TelegramRetryAfter as e:
+                FLOOD_CONTROL.inc(method=method)
+                FLOOD_CONTROL_SECONDS.inc(e.retry_after)
+                self.pause(e.retry_after)
+                error_logger.warning(
+                    f"Flood control on chat {chat_id}: pausing all sends for {e.retry_after}s "
+                    f"(attempt {attempt}/{MAX_RETRIES})"
+                )
+                if attempt == MAX_RETRIES:
+                    raise
+            except Exception as e:
+                TELEGRAM_ERRORS.inc(method=method, error=type(e).__name__)
+                raise
+            finally:
+                TELEGRAM_SECONDS.observe(time.perf_counter() - started, method=method)
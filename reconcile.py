@@ -0,0 +1,168 @@
+# reconcile.py
+import asyncio
+import time
+
+import aiosqlite
+
+from database import begin_immediate, connect
+from job_queue import PRIORITY_CONTENT, PRIORITY_COSMETIC, enqueue_jobs
+from notify import notify_watcher
+
+RECONCILE_BATCH_SIZE = 2000    # product ids compared per step
+RECONCILE_INTERVAL = 60 * 60   # seconds between two full passes from the watcher
+CURSOR_KEY = "reconcile_cursor"            # watcher_state: last product id covered, 0 = idle
+FINISHED_KEY = "reconcile_finished_at"     # watcher_state: unix time the last pass ended
+
+# Upper bound of the next window: ids from both products and product_messages,
+# so posts of products that no longer exist are covered too.
+NEXT_WINDOW_SQL = """
+    SELECT MAX(id) FROM (
+        SELECT id FROM products WHERE id > :since
+        UNION
+        SELECT product_id FROM product_messages WHERE product_id > :since
+        ORDER BY 1
+        LIMIT :limit
+    )
+"""
+
+# What every product in the window needs, given its row, its images and its
+# post. Products that already have a job are left to the queue. Images known
+# to be bad are left out of posts (see image_checks.usable_images), so they
+# are left out of the comparison too.
+RECONCILE_SQL = """
+    SELECT id,
+           CASE
+               WHEN posted AND (visible IS NOT 1 OR IFNULL(stock, 0) = 0) THEN 'remove'
+               WHEN NOT posted AND visible = 1 AND IFNULL(stock, 0) <> 0 THEN 'post'
+               WHEN posted AND (needs_update = 1 OR caption_hash IS NULL OR images IS NOT posted_images) THEN 'update'
+           END AS action
+    FROM (
+        SELECT p.id, p.visible, p.stock, p.needs_update, p.caption_hash,
+               EXISTS (SELECT 1 FROM product_messages m WHERE m.product_id = p.id) AS posted,
+               (SELECT group_concat(image_url, ' ') FROM (
+                   SELECT image_url FROM product_images i
+                   WHERE i.product_id = p.id
+                     AND (NOT EXISTS (SELECT 1 FROM image_checks c WHERE c.image_url = i.image_url AND c.ok = 0)
+                          OR EXISTS (SELECT 1 FROM telegram_files f WHERE f.image_url = i.image_url))
+                   ORDER BY i.id
+               )) AS images,
+               (SELECT group_concat(image_url, ' ') FROM (
+                   SELECT image_url FROM product_messages m
+                   WHERE m.product_id = p.id AND m.image_url IS NOT NULL ORDER BY m.message_id
+               )) AS posted_images
+        FROM products p
+        WHERE p.id > :since AND p.id <= :upper
+          AND NOT EXISTS (SELECT 1 FROM publish_jobs j WHERE j.product_id = p.id)
+    )
+    WHERE action IS NOT NULL
+    UNION ALL
+    SELECT DISTINCT m.product_id, 'remove'
+    FROM product_messages m
+    WHERE m.product_id > :since AND m.product_id <= :upper
+      AND NOT EXISTS (SELECT 1 FROM products p WHERE p.id = m.product_id)
+      AND NOT EXISTS (SELECT 1 FROM publish_jobs j WHERE j.product_id = m.product_id)
+"""
+
+
+async def iter_reconcile_batches(db: aiosqlite.Connection, since: int = 0, batch_size: int = RECONCILE_BATCH_SIZE):
+    """Yield (upper, to_post, to_update, to_remove) per window of product ids after `since`.
+
+    Memory is bounded by batch_size whatever the catalog size; resume a pass
+    by passing the last `upper` back in as `since`.
+    """
+    while True:
+        async with db.execute(NEXT_WINDOW_SQL, {"since": since, "limit": batch_size}) as cursor:
+            (upper,) = await cursor.fetchone()
+        if upper is None:
+            return
+
+        sets = {"post": [], "update": [], "remove": []}
+        async with db.execute(RECONCILE_SQL, {"since": since, "upper": upper}) as cursor:
+            async for product_id, action in cursor:
+                sets[action].append(product_id)
+
+        yield upper, sets["post"], sets["update"], sets["remove"]
+        since = upper
+
+
+async def get_state(db: aiosqlite.Connection, key: str, default: int = 0):
+    async with db.execute("SELECT value FROM watcher_state WHERE key = ?", (key,)) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else default
+
+
+async def set_state(db: aiosqlite.Connection, key: str, value: int):
+    await db.execute(
+        """
+        INSERT INTO watcher_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """,
+        (key, value)
+    )
+
+
+async def enqueue_batch(db: aiosqlite.Connection, upper: int, to_post: list[int], to_update: list[int],
+                        to_remove: list[int]):
+    """Queue the jobs of one window and move the cursor past it, in one commit."""
+    await enqueue_jobs(db, "publish", to_post, priority=PRIORITY_CONTENT)
+    await enqueue_jobs(db, "publish", to_update, priority=PRIORITY_COSMETIC)
+    await enqueue_jobs(db, "delete", to_remove)
+    await set_state(db, CURSOR_KEY, upper)
+    await db.commit()
+
+
+async def finish_pass(db: aiosqlite.Connection):
+    await set_state(db, CURSOR_KEY, 0)
+    await set_state(db, FINISHED_KEY, int(time.time()))
+    await db.commit()
+
+
+async def reconcile_step(db: aiosqlite.Connection, interval: int = RECONCILE_INTERVAL):
+    """One window of the scheduled pass, called from every watcher pass.
+
+    Starts a new pass every `interval` seconds and continues an unfinished
+    one (also after a restart) from the stored cursor. Returns True while a
+    pass is in progress.
+
+    The window is read and the cursor moved under the write lock, so several
+    watcher processes split a pass instead of each repeating it.
+    """
+    if await get_state(db, CURSOR_KEY) == 0 and time.time() - await get_state(db, FINISHED_KEY) < interval:
+        return False
+
+    await begin_immediate(db)
+    since = await get_state(db, CURSOR_KEY)
+    if since == 0 and time.time() - await get_state(db, FINISHED_KEY) < interval:
+        await db.commit()  # another watcher just finished the pass
+        return False
+
+    batches = iter_reconcile_batches(db, since)
+    batch = await anext(batches, None)
+    await batches.aclose()
+    if batch is None:
+        await finish_pass(db)
+        return False
+
+    await enqueue_batch(db, *batch)
+    return True
+
+
+async def reconcile_all(db: aiosqlite.Connection):
+    """Run a whole pass now (resuming an interrupted one). Returns (post, update, remove) counts."""
+    counts = [0, 0, 0]
+    async for upper, *sets in iter_reconcile_batches(db, await get_state(db, CURSOR_KEY)):
+        await enqueue_batch(db, upper, *sets)
+        counts = [total + len(found) for total, found in zip(counts, sets)]
+    await finish_pass(db)
+    return tuple(counts)
+
+
+async def main():
+    async with connect() as db:
+        posts, updates, removals = await reconcile_all(db)
+    notify_watcher()
+    print(f"✅ Reconciled: {posts} to post, {updates} to update, {removals} to remove queued.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
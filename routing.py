@@ -0,0 +1,77 @@
+# routing.py
+import json
+import os
+from typing import NamedTuple
+
+from aiogram import Bot
+
+from config import BOT_TOKEN, CHANNEL_ID, ROUTES_FILE
+
+DEFAULT_CHANNEL = "default"
+
+# ROUTES_FILE looks like this; a channel takes its token from "token" or from
+# the environment variable named by "token_env". Categories without a route go
+# to "default". Channels sharing a token share one Bot and its rate budget.
+#
+# {
+#     "channels": {
+#         "main": {"chat_id": "-1001111111111", "token_env": "BOT_TOKEN"},
+#         "bags": {"chat_id": "-1002222222222", "token_env": "BOT_TOKEN_BAGS"}
+#     },
+#     "routes": {"Рюкзаки": "bags", "Сумки": "bags"},
+#     "default": "main"
+# }
+
+
+class Channel(NamedTuple):
+    name: str
+    chat_id: str
+    bot: Bot
+
+
+class Router:
+    """Which channel (chat and bot) a product is published to, by its category."""
+
+    def __init__(self, channels: list[Channel], routes: dict[str, str] = None, default: str = DEFAULT_CHANNEL):
+        self.channels = {channel.name: channel for channel in channels}
+        self.routes = dict(routes or {})
+        self.default = default
+        unknown = {name for name in [default, *self.routes.values()] if name not in self.channels}
+        if unknown:
+            raise ValueError(f"Routes point to unknown channels: {', '.join(sorted(unknown))}")
+        self._by_chat = {str(channel.chat_id): channel for channel in channels}
+
+    @property
+    def default_channel(self) -> Channel:
+        return self.channels[self.default]
+
+    def for_category(self, category: str) -> Channel:
+        return self.channels[self.routes.get(category, self.default)]
+
+    def for_chat(self, chat_id) -> Channel:
+        """The channel posting to chat_id; the default one for chats no longer configured."""
+        return self._by_chat.get(str(chat_id), self.default_channel)
+
+    async def close(self):
+        for bot in {id(channel.bot): channel.bot for channel in self.channels.values()}.values():
+            await bot.session.close()
+
+
+def load_router(path: str = ROUTES_FILE) -> Router:
+    """Router from the routes file, or a single channel from BOT_TOKEN / CHANNEL_ID without one."""
+    if not os.path.exists(path):
+        return Router([Channel(DEFAULT_CHANNEL, CHANNEL_ID, Bot(token=BOT_TOKEN))])
+
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    bots = {}
+    channels = []
+    for name, settings in config["channels"].items():
+        token = settings.get("token") or os.getenv(settings.get("token_env", "BOT_TOKEN"))
+        if not token:
+            raise ValueError(f"Channel {name!r} has no bot token")
+        if token not in bots:
+            bots[token] = Bot(token=token)
+        channels.append(Channel(name, str(settings["chat_id"]), bots[token]))
+    return Router(channels, config.get("routes", {}), config.get("default", DEFAULT_CHANNEL))